@@ -0,0 +1,278 @@
+# python ./benchmarks/bench_gendb.py --sizes 1000 10000 100000 --output baseline.json
+# python ./benchmarks/bench_gendb.py --sizes 1000 10000 100000 --compare baseline.json
+#
+# Generates synthetic SQLite databases and times the main SQLServer code paths against them.
+# Requires the same SQLite ODBC driver as tests/test_db_sqlite.py (pass --driver to change it).
+# Results (seconds, rows/sec and peak traced memory per case and size) are written as JSON so a
+# later run can be compared against them.
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+# Keep per query log output from dominating the timings unless asked for
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from gendb.db import SQLServer
+
+COLUMN_TYPES = {
+    "int": ("integer", lambda r, i: r.randint(0, 1000000)),
+    "real": ("real", lambda r, i: r.random() * 1000),
+    "text": ("text", lambda r, i: "value_{}_{}".format(i, r.randint(0, 999))),
+}
+
+
+### Synthetic data
+def column_layout(width, types):
+    # benchKey is always first so conditionals and sorting have a predictable field
+    columns = [("benchKey", "integer")]
+    for pos in range(width - 1):
+        name = types[pos % len(types)]
+        columns.append(("col{}_{}".format(pos, name), COLUMN_TYPES[name][0]))
+    return columns
+
+
+def generate_db(dataDir, rows, width, types, seed=1234):
+    dbFile = Path(dataDir) / "bench_{}_{}_{}.db".format(rows, width, "_".join(types))
+    if dbFile.exists():
+        return dbFile
+
+    print("Generating {} ({} rows, {} columns)".format(dbFile, rows, width))
+    columns = column_layout(width, types)
+    generators = [None] + [COLUMN_TYPES[types[p % len(types)]][1] for p in range(width - 1)]
+    rand = random.Random(seed)
+
+    tmpFile = dbFile.with_suffix(".tmp")
+    if tmpFile.exists():
+        tmpFile.unlink()
+    conn = sqlite3.connect(str(tmpFile))
+    c = conn.cursor()
+    c.execute(
+        "CREATE TABLE benchTable ({})".format(", ".join("{} {}".format(n, t) for n, t in columns))
+    )
+    insert = "INSERT INTO benchTable VALUES ({})".format(",".join(["?"] * width))
+
+    def data():
+        for i in range(rows):
+            yield [i] + [gen(rand, i) for gen in generators[1:]]
+
+    c.executemany(insert, data())
+    conn.commit()
+    conn.close()
+    tmpFile.rename(dbFile)
+    return dbFile
+
+
+### Measurement
+def measure(func, repeat, trackMemory):
+    # Best wall time over `repeat` runs, plus peak traced memory from one extra run
+    best = None
+    for _ in range(repeat):
+        setup = func()
+        started = time.perf_counter()
+        setup()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if trackMemory:
+        setup = func()
+        tracemalloc.start()
+        setup()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def check_result(db, rows):
+    # run_query logs errors instead of raising them, a failed query must not be timed as a result
+    if db.error is not None:
+        raise RuntimeError("query failed: {!r}".format(db.error))
+    if len(db.result) != rows:
+        raise RuntimeError("expected {} rows, got {}".format(rows, len(db.result)))
+
+
+def bench_cases(env, outputDir, rows):
+    sql = "SELECT * FROM benchTable WHERE 1 = 1 "
+
+    def new_db():
+        return SQLServer(env=env, sql=sql, inVars=None, dbg=False)
+
+    def loaded_db():
+        db = new_db()
+        db.run_query()
+        check_result(db, rows)
+        return db
+
+    def checked_run(db):
+        def run():
+            db.run_query()
+            check_result(db, rows)
+
+        return run
+
+    # Each case returns a callable that performs the timed work, setup happens outside the timer
+    def run_query():
+        db = new_db()
+        return checked_run(db)
+
+    def run_query_tuples():
+        db = new_db()
+        db.settings["row_factory"] = "tuple"
+        return checked_run(db)
+
+    def run_query_fetch_budget():
+        db = new_db()
+        db.settings["fetch_budget"] = 8 * 1024 * 1024
+        return checked_run(db)
+
+    def add_conditional():
+        def build():
+            db = new_db()
+            for pos in range(50):
+                db.add_conditional("benchKey", ">", pos)
+                db.add_conditional("benchKey", "in", [pos, pos + 1, pos + 2])
+                db.add_conditional("benchKey", "!=", None)
+
+        return build
+
+    def select_fields():
+        db = loaded_db()
+        fields = list(db.get_fields())[:2]
+        return lambda: db.select_fields(fields)
+
+    def rename_fields():
+        db = loaded_db()
+        renames = {f: f + "_renamed" for f in db.get_fields()}
+        return lambda: db.rename_fields(renames)
+
+    def get_field_data():
+        db = loaded_db()
+        return lambda: db.get_field_data("benchKey")
+
+    def export_csv():
+        db = loaded_db()
+        return lambda: db.export_csv(Path(outputDir) / "bench.csv")
+
+    def export_json():
+        db = loaded_db()
+        return lambda: db.export_json(Path(outputDir) / "bench.json")
+
+    return {
+        "run_query": run_query,
+        "run_query_tuples": run_query_tuples,
+        "run_query_fetch_budget": run_query_fetch_budget,
+        "add_conditional": add_conditional,
+        "select_fields": select_fields,
+        "rename_fields": rename_fields,
+        "get_field_data": get_field_data,
+        "export_csv": export_csv,
+        "export_json": export_json,
+    }
+
+
+def run_benchmarks(args):
+    dataDir = Path(args.data_dir)
+    dataDir.mkdir(parents=True, exist_ok=True)
+
+    results = dict()
+    for rows in args.sizes:
+        dbFile = generate_db(dataDir, rows, args.width, args.types)
+        env = {"driver": args.driver, "database": dbFile, "server": "localhost"}
+        for name, case in bench_cases(env, dataDir, rows).items():
+            if args.cases and name not in args.cases:
+                continue
+            print("Benchmark: {} rows={}".format(name, rows))
+            seconds, peak = measure(case, args.repeat, not args.no_memory)
+            results.setdefault(name, dict())[str(rows)] = {
+                "seconds": seconds,
+                "rows_per_sec": rows / seconds if seconds else None,
+                "peak_bytes": peak,
+            }
+
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "driver": args.driver,
+            "width": args.width,
+            "types": args.types,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    # Prints the ratio current/baseline per case and size, returns the number of regressions
+    regressions = 0
+    for name, sizes in sorted(current["results"].items()):
+        for rows, now in sorted(sizes.items(), key=lambda kv: int(kv[0])):
+            before = baseline.get("results", {}).get(name, {}).get(rows)
+            if not before:
+                print("{:<16} {:>10}  (no baseline)".format(name, rows))
+                continue
+            timeRatio = now["seconds"] / before["seconds"] if before["seconds"] else None
+            memRatio = None
+            if now.get("peak_bytes") and before.get("peak_bytes"):
+                memRatio = now["peak_bytes"] / before["peak_bytes"]
+            flag = ""
+            if (timeRatio and timeRatio > 1 + threshold) or (memRatio and memRatio > 1 + threshold):
+                flag = "  REGRESSION"
+                regressions += 1
+            print(
+                "{:<16} {:>10}  time x{}  memory x{}{}".format(
+                    name,
+                    rows,
+                    "{:.2f}".format(timeRatio) if timeRatio else "-",
+                    "{:.2f}".format(memRatio) if memRatio else "-",
+                    flag,
+                )
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="genDB benchmark suite on synthetic SQLite data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--width", type=int, default=10, help="number of columns")
+    parser.add_argument(
+        "--types", nargs="+", default=["int", "real", "text"], choices=sorted(COLUMN_TYPES)
+    )
+    parser.add_argument("--cases", nargs="+", help="only run these cases")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--driver", default="{Devart ODBC Driver for SQLite}")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "gendb_bench"))
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="allowed slowdown (0.10 = 10%%)"
+    )
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(current, fd, indent=2)
+        print("Results written to: {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        if compare(current, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# python ./benchmarks/bench_import.py --output import_baseline.json
+# python ./benchmarks/bench_import.py --compare import_baseline.json
+#
+# Times "import gendb.db" (and the other modules given with --modules) in fresh interpreters and
+# checks that importing stays free of side effects: nothing printed, no log folder created and
+# pyodbc not loaded. Uses python -X importtime to list the slowest imports below each module.
+# Exits with 1 when a check fails or, with --compare, when an import got slower than allowed.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+CHECK_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+sys.stderr.write("GENDB_IMPORT %r %r\\n" % (elapsed, "pyodbc" in sys.modules))
+"""
+
+
+def run_import(module, logFolder):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["LOG_FOLDER"] = str(logFolder)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHECK_SCRIPT.format(module=module)],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError("import {} failed:\n{}".format(module, proc.stderr[-2000:]))
+    seconds = None
+    pyodbcLoaded = None
+    imports = []
+    for line in proc.stderr.splitlines():
+        if line.startswith("GENDB_IMPORT "):
+            elapsed, loaded = line.split()[1:]
+            seconds = float(elapsed)
+            pyodbcLoaded = loaded == "True"
+        elif line.startswith("import time:") and "|" in line:
+            # import time: self [us] | cumulative | imported package
+            parts = line[len("import time:") :].split("|")
+            if parts[0].strip().isdigit():
+                imports.append((int(parts[1]), int(parts[0]), parts[2].rstrip()))
+    return {
+        "seconds": seconds,
+        "stdout": proc.stdout,
+        "pyodbc_loaded": pyodbcLoaded,
+        "log_folder_created": Path(logFolder).exists(),
+        "imports": imports,
+    }
+
+
+def bench_module(module, repeat, top):
+    best = None
+    checks = []
+    slowest = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            run = run_import(module, Path(tmp) / "logs")
+        if best is None or run["seconds"] < best["seconds"]:
+            best = run
+        if run["stdout"]:
+            checks.append("printed to stdout: {!r}".format(run["stdout"][:200]))
+        if run["pyodbc_loaded"]:
+            checks.append("pyodbc imported")
+        if run["log_folder_created"]:
+            checks.append("log folder created")
+
+    # slowest imports below the module, by time spent in the import itself
+    for cumulative, self_us, name in sorted(best["imports"], key=lambda i: -i[1])[:top]:
+        slowest.append({"module": name.strip(), "self_us": self_us, "cumulative_us": cumulative})
+    return {"seconds": best["seconds"], "failed_checks": sorted(set(checks)), "slowest": slowest}
+
+
+def compare(current, baseline, threshold):
+    # Prints the ratio current/baseline per module, returns the number of regressions
+    regressions = 0
+    for module, now in sorted(current["results"].items()):
+        before = baseline.get("results", {}).get(module)
+        if not before or not before.get("seconds"):
+            print("{:<24} (no baseline)".format(module))
+            continue
+        ratio = now["seconds"] / before["seconds"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("{:<24} time x{:.2f}{}".format(module, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="genDB import time benchmark")
+    parser.add_argument("--modules", nargs="+", default=["gendb.db"])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.20, help="allowed slowdown (0.20 = 20%%)"
+    )
+    args = parser.parse_args(argv)
+
+    results = dict()
+    failed = 0
+    for module in args.modules:
+        result = bench_module(module, args.repeat, args.top)
+        results[module] = result
+        print("{:<24} {:.4f}s".format(module, result["seconds"]))
+        for item in result["slowest"]:
+            print(
+                "    {:<36} self {:>8} us  cumulative {:>8} us".format(
+                    item["module"], item["self_us"], item["cumulative_us"]
+                )
+            )
+        for check in result["failed_checks"]:
+            print("    FAILED: {}".format(check))
+            failed += 1
+
+    current = {
+        "meta": {
+            "created": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(current, fd, indent=2)
+        print("Results written to: {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        if compare(current, baseline, args.threshold):
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
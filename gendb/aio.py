@@ -0,0 +1,112 @@
+# Python Libaries
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+### User Modules
+from .log import get_logger
+from .db import SQLServer, base_environment
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Example Usage
+# db = AsyncSQLServer(env=env, sql="SELECT * FROM testTable WHERE 1 = 1")
+# db.add_conditional("testInt", ">", 10)
+# result = await db.run_query()
+# async for row in db.iter_query():
+#     ...
+# results = await gather_queries([db1.run_query(), db2.run_query()], limit=8)
+###
+
+default_workers = 8
+
+# Worker threads are shared between instances with the same worker count
+_executors = dict()
+_executorsLock = threading.Lock()
+
+
+def get_executor(maxWorkers=default_workers):
+    with _executorsLock:
+        executor = _executors.get(maxWorkers)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=maxWorkers, thread_name_prefix=f"gendb-aio-{maxWorkers}"
+            )
+            _executors[maxWorkers] = executor
+        return executor
+
+
+class AsyncSQLServer:
+    # Runs the blocking SQLServer calls on a bounded worker pool, each worker borrowing a
+    # pooled pyodbc connection, so the event loop is never blocked
+    def __init__(
+        self,
+        env=base_environment,
+        sql="",
+        inVars=None,
+        dbg=False,
+        maxWorkers=default_workers,
+        executor=None,
+    ):
+        self.db = SQLServer(env=env, sql=sql, inVars=inVars, dbg=dbg)
+        self.db.settings["pool"] = True
+        self.db.settings["pool_options"] = {"maxSize": maxWorkers}
+        self._executor = executor if executor is not None else get_executor(maxWorkers)
+
+    def __getattr__(self, name):
+        # Everything that does not touch the database (env, sql, vars, result, settings,
+        # add_conditional, select_fields, ...) is handled by the wrapped instance
+        return getattr(self.__dict__["db"], name)
+
+    def __setattr__(self, name, value):
+        if name in ("db", "_executor"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.db, name, value)
+
+    ###### Methods ######
+    async def run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def run_query(self):
+        # SQLServer.run_query logs errors instead of raising them, raise here so awaiting code
+        # (and gather_queries with return_exceptions) sees the failure instead of an old result
+        await self.run_in_executor(self.db.run_query)
+        if self.db.error is not None:
+            raise self.db.error
+        return self.db.result
+
+    async def run_builder(self, builder, valueSets=None):
+        return await self.run_in_executor(self.db.run_builder, builder, valueSets)
+
+    async def iter_query(self, batchSize=None, batches=False):
+        # async for row in db.iter_query(): each batch is fetched on a worker thread
+        gen = self.db.iter_query(batchSize, batches=True)
+        try:
+            while True:
+                batch = await self.run_in_executor(next, gen, None)
+                if batch is None:
+                    break
+                if batches:
+                    yield batch
+                else:
+                    for row in batch:
+                        yield row
+        finally:
+            await self.run_in_executor(gen.close)
+
+
+async def gather_queries(queries, limit=default_workers, return_exceptions=False):
+    # Awaits many coroutines (e.g. AsyncSQLServer.run_query()) with at most `limit` running
+    # at a time, results are returned in the order the queries were passed in
+    queries = list(queries)
+    semaphore = asyncio.Semaphore(limit)
+
+    async def limited(query):
+        async with semaphore:
+            return await query
+
+    logger.info(f"Gathering {len(queries)} queries: concurrency limit {limit}")
+    return await asyncio.gather(*[limited(q) for q in queries], return_exceptions=return_exceptions)
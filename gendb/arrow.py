@@ -0,0 +1,118 @@
+# Python Libaries
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Arrow IPC / Parquet export (optional dependency: pip install gendb[arrow])
+# Column types come from cursor.description (pyodbc reports a Python type per column),
+# rows are converted one fetchmany batch at a time into Arrow record batches. Parquet batches
+# are buffered into row groups of rowGroupSize rows, a row group per fetch batch would make files
+# with many tiny row groups that compress and scan poorly.
+
+ROW_GROUP_ROWS = 128 * 1024
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        logger.error("Error! Arrow and Parquet exports require pyarrow: pip install gendb[arrow]")
+        return None
+    return pyarrow
+
+
+def arrow_type(pa, column):
+    # column is one cursor.description entry: (name, type_code, display_size, internal_size,
+    # precision, scale, null_ok)
+    typeCode = column[1]
+    if typeCode is bool:
+        return pa.bool_()
+    if typeCode is int:
+        return pa.int64()
+    if typeCode is float:
+        return pa.float64()
+    if typeCode is Decimal:
+        precision, scale = column[4], column[5]
+        if precision and 0 < precision <= 38 and scale is not None:
+            return pa.decimal128(precision, scale)
+        return pa.float64()
+    if typeCode is datetime:
+        return pa.timestamp("us")
+    if typeCode is date:
+        return pa.date32()
+    if typeCode is time:
+        return pa.time64("us")
+    if typeCode in (bytes, bytearray):
+        return pa.binary()
+    return pa.string()
+
+
+def arrow_schema(pa, description, positions):
+    return pa.schema(
+        [pa.field(description[p][0], arrow_type(pa, description[p]), True) for p in positions]
+    )
+
+
+def _convert(value):
+    # Values pyarrow does not accept for the mapped type
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def record_batch(pa, schema, rows, positions):
+    arrays = []
+    for field, p in zip(schema, positions):
+        values = [row[p] for row in rows]
+        if pa.types.is_string(field.type):
+            values = [v if v is None or isinstance(v, str) else str(_convert(v)) for v in values]
+        elif pa.types.is_floating(field.type):
+            values = [None if v is None else float(v) for v in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ArrowFileWriter:
+    # fmt: "arrow" (Arrow IPC file) or "parquet"
+    def __init__(self, pa, path, schema, fmt, compression=None, rowGroupSize=None):
+        self.fmt = fmt
+        self.rowGroupSize = rowGroupSize or ROW_GROUP_ROWS
+        self._pending = []
+        self._pendingRows = 0
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(str(path), schema, compression=compression or "snappy")
+        else:
+            options = None
+            if compression:
+                options = pa.ipc.IpcWriteOptions(compression=compression)
+            self._writer = pa.ipc.new_file(str(path), schema, options=options)
+        self._pa = pa
+
+    def write(self, batch):
+        if self.fmt != "parquet":
+            self._writer.write_batch(batch)
+            return
+        self._pending.append(batch)
+        self._pendingRows += batch.num_rows
+        if self._pendingRows >= self.rowGroupSize:
+            self._flush(self._pendingRows // self.rowGroupSize * self.rowGroupSize)
+
+    def _flush(self, rows):
+        # Writes the first rows pending rows as full row groups, the rest stays buffered
+        table = self._pa.Table.from_batches(self._pending)
+        self._writer.write_table(table.slice(0, rows), row_group_size=self.rowGroupSize)
+        self._pending = table.slice(rows).to_batches()
+        self._pendingRows -= rows
+
+    def close(self):
+        if self._pendingRows:
+            self._flush(self._pendingRows)
+        self._writer.close()
@@ -0,0 +1,174 @@
+# Python Libaries
+import copy
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Example Usage
+# cache = ResultCache(ttl=60, maxEntries=500, maxBytes=64 * 1024 * 1024)
+# db.settings["cache"] = cache
+# db.settings["cache_tags"] = ["testTable"]
+# db.run_query()  # miss: runs the query and stores the result
+# db.run_query()  # hit: no connection is opened
+# cache.invalidate("testTable")
+#
+# SQLServer stores a copy of each result and hands out a copy on every hit (copy_result), so
+# changing db.result never changes the cached entry
+###
+
+cache_defaults = {
+    "ttl": 60,  # seconds
+    "max_entries": 1024,
+    "max_bytes": 64 * 1024 * 1024,
+}
+
+
+def estimate_size(result, sample=20):
+    # Rough size of a result: container plus the average of the first rows times the row count
+    count = len(result)
+    size = sys.getsizeof(result)
+    if not count:
+        return size
+    rows = [result[i] for i in range(min(count, sample))]
+    rowSize = 0
+    for row in rows:
+        rowSize += sys.getsizeof(row)
+        values = row.values() if isinstance(row, dict) else row
+        rowSize += sum(sys.getsizeof(v) for v in values)
+    return size + int(rowSize / len(rows) * count)
+
+
+def copy_result(result):
+    # Rows that can be written to are copied, immutable tuple and namedtuple rows are shared
+    if isinstance(result, list):
+        rowFormat = getattr(result, "rowFormat", "dict")
+        if rowFormat in ("tuple", "namedtuple"):
+            return copy.copy(result)
+        if rowFormat == "record":
+            rows = copy.copy(result)
+            rows[:] = [type(row)(*row) for row in result]
+            return rows
+        return [dict(row) if isinstance(row, dict) else row for row in result]
+    # ColumnarResult and NumpyResult keep their data in lists and arrays shared with views
+    return copy.deepcopy(result)
+
+
+class ResultCache:
+    def __init__(
+        self,
+        ttl=cache_defaults["ttl"],
+        maxEntries=cache_defaults["max_entries"],
+        maxBytes=cache_defaults["max_bytes"],
+    ):
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+
+        # key: (expires, size, tags, value), least recently used first
+        self._entries = OrderedDict()
+        self._tags = dict()  # tag: set of keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "invalidated": 0}
+
+    ###### Methods ######
+    def get(self, key):
+        # Returns (True, value) on a hit and (False, None) on a miss
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return False, None
+            if entry[0] is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return True, entry[3]
+
+    def put(self, key, value, tags=(), ttl=None):
+        size = estimate_size(value)
+        if self.maxBytes is not None and size > self.maxBytes:
+            logger.info(f"Result Cache: result too large to cache ({size} bytes)")
+            return False
+
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        tags = frozenset(tags or ())
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, size, tags, value)
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._evict()
+        return True
+
+    def invalidate(self, tag):
+        # Drops every entry stored with the tag (e.g. a table name)
+        with self._lock:
+            keys = self._tags.pop(tag, set())
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+                    self._stats["invalidated"] += 1
+        logger.info(f"Result Cache: invalidated {len(keys)} entries for tag {tag}")
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        return stats
+
+    ###### Helpers ######
+    def _remove(self, key):
+        # Called with the lock held
+        _, size, tags, _ = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _evict(self):
+        # Called with the lock held, drops least recently used entries until within limits
+        while self._entries and (
+            (self.maxEntries is not None and len(self._entries) > self.maxEntries)
+            or (self.maxBytes is not None and self._bytes > self.maxBytes)
+        ):
+            self._remove(next(iter(self._entries)))
+            self._stats["evicted"] += 1
+
+
+### Process wide cache that instances can opt into with db.settings["cache"] = shared_cache()
+_sharedCache = None
+_sharedLock = threading.Lock()
+
+
+def shared_cache():
+    global _sharedCache
+    with _sharedLock:
+        if _sharedCache is None:
+            _sharedCache = ResultCache()
+        return _sharedCache
@@ -1,13 +1,53 @@
 # Python Libaries
 from pathlib import Path
-import pyodbc
-import re
 import csv
 import json
+import time
 from datetime import datetime
+from itertools import islice
 
 ### User Modules
 from .log import get_logger
+from .pool import get_pool
+from .cache import copy_result
+from .dialect import resolve_dialect
+from .result import ColumnarResult
+from .index import build_index
+from .template import compile_sql, get_template
+from .rows import RowList, iter_dicts, row_factory
+from .refresh import load_watermark, max_watermark, merge_rows, save_watermark
+from .inlist import (
+    ChunkedCursor,
+    InListChunks,
+    TempTableList,
+    chunk_safe,
+    expand_in_lists,
+    in_list_markers,
+    large_in_conditional,
+    param_count,
+)
+from .fetch import BatchSizer
+from .trace import finish_span, get_global_tracer, start_span
+from .paging import (
+    Page,
+    decode_token,
+    encode_token,
+    keyset_predicate,
+    order_clause,
+    parse_order_by,
+)
+from .query import (
+    QueryBuilder,
+    build_conditional,
+    describe_sql,
+    project_sql,
+    projection_list,
+    valid_field,
+    checkNumeric,
+    convertString,
+    insert_statement,
+    upsert_statement,
+)
 
 logger = get_logger(f"{__package__}.{__name__}")
 
@@ -31,58 +71,62 @@ class DateTimeEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
 
-def checkNumeric(inDriver, field):
-    # check if database is TSQL
-    if re.search("SQL Server", inDriver):
-        return "ISNUMERIC({}) = 1".format(field)
-
-    # check if database is SQLite
-    if re.search("SQLite", inDriver):
-        # "(typeof({}) = 'integer' OR typeof({}) = 'real' OR {} GLOB '[1-9]')"
-        # "(typeof({}) = 'integer' OR typeof({}) = 'real' OR {} REGEXP '/^\d*\.?\d+$/' )"
-        # return "(typeof({}) = 'integer' OR typeof({}) = 'real')".format(field, field, field)
-        return None
-
-    # check if database is Postgres
-    if re.search("PostgreSQL", inDriver):
-        return None
-
-    # check if database is Oracle
-    if re.search("Oracle", inDriver):
-        return None
-
-
-def convertString(inDriver, field, value):
-    if re.search("SQL Server", inDriver):
-        if isinstance(value, int):
-            return "TRY_CONVERT(bigint, {})".format(field)
-        if isinstance(value, float):
-            return "TRY_CONVERT(dec(38,2), {})".format(field)
-
-    if re.search("SQLite", inDriver):
-        if isinstance(value, int):
-            return "CAST({} AS INT)".format(field)
-        if isinstance(value, float):
-            return "CAST({} AS REAL)".format(field)
-
-    if re.search("PostgreSQL", inDriver):
-        return field
-
-    if re.search("Oracle", inDriver):
-        return field
-
-
 class SQLServer:
     def __init__(self, env=base_environment, sql="", inVars=None, dbg=False):
-        self.__env = base_environment
+        # copy the defaults so instances with different environments do not share one dictionary
+        self.__env = dict(base_environment)
+        self.dialect = resolve_dialect(None)
         self.env = env
         logger.info(f'Initializing Database Class: ENV: {self.env["server"]} ')
         self.sql = sql
         self.vars = inVars
         self.result = list()
         self._conditionVars = list()
-        self.settings = {"timeout": 45}
+        # pool: reuse connections from a process wide pool keyed by the connection string
+        # batch_size: rows pulled per fetchmany call when streaming
+        # fetch_budget: bytes of rows per fetchmany call, batch sizes then follow the observed row
+        #   width (run_query fetches in batches too), None keeps batch_size rows per call
+        # columnar: store run_query results as a ColumnarResult instead of a list of dictionaries
+        # numpy: store run_query results as a gendb.npresult.NumpyResult of typed arrays
+        # row_factory: "dict", "tuple", "namedtuple" or "record" rows for the default list result
+        # spill: store run_query results as a SpillResult, rows past spill_budget bytes are
+        #   written to a temporary file in spill_dir (system temp folder when None)
+        # cache: a gendb.cache.ResultCache, run_query results are stored with the cache_tags
+        # in_list_threshold: IN lists longer than this use a temp table or chunked statements,
+        #   None rewrites lists that would take the statement past the dialect's parameter limit
+        self.settings = {
+            "timeout": 45,
+            "pool": False,
+            "pool_options": {},
+            "batch_size": 1000,
+            "fetch_budget": None,
+            "columnar": False,
+            "numpy": False,
+            "spill": False,
+            "spill_budget": 256 * 1024 * 1024,
+            "spill_dir": None,
+            "bulk_chunk_size": 1000,
+            "fast_executemany": True,
+            "cache": None,
+            "cache_tags": [],
+            "in_list_threshold": None,
+            "row_factory": "dict",
+        }
         self.debug = dbg
+        # last exception raised by run_query (run_query logs errors instead of raising them)
+        self.error = None
+        self.description = None
+        # gendb.trace.TraceCollector (or compatible) timing each query phase, None disables tracing
+        self.tracer = None
+        # highest watermark value merged by refresh()
+        self.watermark = None
+        # [(field, alias)] selected instead of every column, set with project()
+        self.projection = None
+        # batch sizes and estimated batch memory of the last fetch, see gendb.fetch.BatchSizer
+        self.fetch_stats = None
+        # pool each borrowed connection came from, keyed by id(conn), so it goes back to that
+        # pool even when the environment or the pool setting changed meanwhile
+        self._connPools = dict()
 
     ###### Properties ######
     @property
@@ -108,32 +152,42 @@ class SQLServer:
             inDictLowerCase = {k.lower(): v for k, v in inEnv.items()}
             logger.info(f"Updating:ENV: {inDictLowerCase.keys()}")
             self.__env.update(inDictLowerCase)
+            # Resolve the SQL dialect once, conditionals look up its templates
+            self.dialect = resolve_dialect(self.__env["driver"])
 
     @property
     def sql(self):  # Getter
         return self.__sqlScript
 
     # Setter checks if we are passing in a sql filename or a query
+    # Files come from the template registry (read again only when they change) and :name
+    # parameters are compiled to "?", self.template keeps the parameter order for binding
     @sql.setter
     def sql(self, inSQLString):
         if ".sql" in inSQLString[0:255].lower():
             fullPath = inSQLString
             logger.info(f"Loading SQL Code File: {fullPath}")
-            with open(fullPath, "r") as fd:
-                self.__sqlScript = fd.read()
+            self.template = get_template(fullPath)
         else:
             logger.info(f"Loading SQL Code String: {inSQLString[0:255]}")
-            self.__sqlScript = inSQLString
+            self.template = compile_sql(inSQLString)
+        self.__sqlScript = self.template.sql
 
+    # the statement's parameters: passed in vars followed by the values of the conditionals
     @property
     def vars(self):  # Getter
+        if self._conditionVars:
+            return self._query_vars()
         return self.__sqlVars
 
     @vars.setter
     def vars(self, inVars):
-        logger.info(f"Adding Variables: {inVars}")
+        logger.info("Adding Variables: %s", inVars)
         # Should add a check to make sure the passed in values are single value, tuple, or list
-        if inVars and (not isinstance(inVars, list)):
+        if isinstance(inVars, dict):
+            # {name: value} for the :name parameters of the SQL, bound in placeholder order
+            self.__sqlVars = self.template.bind(inVars)
+        elif inVars and (not isinstance(inVars, list)):
             self.__sqlVars = [inVars]
         else:
             self.__sqlVars = inVars
@@ -145,75 +199,208 @@ class SQLServer:
     @result.setter
     def result(self, inRes):
         self.__result = inRes
+        # indexes point at row positions of the old result, rebuild them on next use
+        self.__indexes = dict()
 
     ###### Methods ######
     # examples
     # db.add_conditional("Number_Field", ">", 700)
     # db.add_conditional("Number_Field", "!=", None)
     def add_conditional(self, field, inType, value):
-        logger.info(f"Updating Conditionals: {field} {inType} {value}")
-        chkConditional = ["=", ">", "<", ">=", "<=", "<>", "!=", "in", "not in", "like", "not like"]
-        if inType.lower() not in chkConditional:
-            logger.error(
-                f"Error! Incompatible Conditional: {inType}. Allowed options: {chkConditional}"
-            )
-            return
-
-        if not isinstance(field, str) or (
-            isinstance(field, str) and (len(field) > 128 or re.search("\W", field) is not None)
-        ):
-            logger.error(
-                f"Error! Incompatible Field: {field}. Must only contain alphanumeric and underscore"
-            )
+        logger.info("Updating Conditionals: %s %s %s", field, inType, value)
+        conditional = None
+        if self._large_in_list(inType, value):
+            if not valid_field(field):
+                return
+            conditional = self._large_in_conditional(field, inType, value)
+        if conditional is None:
+            conditional = build_conditional(self.dialect, field, inType, value)
+        if conditional is None:
             return
 
-        addString = ""
-        # Check if we are search for NULL or excluding NULL values
-        if value == None:
-            if inType == "=":
-                addString = f"{field} is null"
-            elif inType in ["!=", "<>"]:
-                addString = f"{field} is not null"
-
-        # Check if value is in a list
-        elif isinstance(value, list) and inType.lower() in ["in", "not in"]:
-            # Extend array with the values in the list
-            self._conditionVars.extend(value)
-            qString = "(" + ",".join(["?"] * len(value)) + ")"
-            addString = f"{field} {inType} {qString}"
-
-        # Check if value is numeric
-        elif isinstance(value, (int, float)):
-            # Add search value to array
-            self._conditionVars.append(value)
-            qString = "?"
-
-            numCheckStr = checkNumeric(self.env["driver"], field)
-            numConvertStr = convertString(self.env["driver"], field, value)
-            if numCheckStr != None:
-                fieldStr = "{} AND {}".format(numCheckStr, numConvertStr)
-            else:
-                fieldStr = "{}".format(numConvertStr)
+        addString, values = conditional
+        self._conditionVars.extend(values)
+        # Append directly, the sql setter would re-check for a .sql filename on every call
+        self.__sqlScript = f"{self.__sqlScript} AND {addString}"
 
-            addString = f"{fieldStr} {inType} {qString}"
+    def _in_chunk_size(self):
+        # "?" per chunk: the threshold, within what the statement's other parameters leave
+        chunkSize = self.settings["in_list_threshold"] or self.dialect.maxParams // 2
+        room = self.dialect.maxParams - param_count(self._query_vars())
+        return max(min(chunkSize, room), 1)
 
-        # If value is not in a list, not numeric, and not null, search without any data type checks
-        else:
-            # Add search value to array
-            self._conditionVars.append(value)
-            qString = "?"
-            addString = f"{field} {inType} {qString}"
+    def _large_in_list(self, inType, value):
+        if not (
+            isinstance(inType, str)
+            and inType.lower() in ["in", "not in"]
+            and isinstance(value, list)
+        ):
+            return False
+        if self.settings["in_list_threshold"]:
+            return len(value) > self.settings["in_list_threshold"]
+        return param_count(self._query_vars()) + len(value) > self.dialect.maxParams
 
-        self.sql = f"{self.sql} AND {addString}"
+    def _large_in_conditional(self, field, inType, value):
+        # IN / NOT IN lists past the threshold use a temp table or chunked statements
+        markers = [v for v in self._conditionVars if isinstance(v, (TempTableList, InListChunks))]
+        conditional = large_in_conditional(
+            self.dialect,
+            self.__sqlScript,
+            field,
+            inType,
+            value,
+            sum(isinstance(v, TempTableList) for v in markers),
+            self._in_chunk_size(),
+            any(isinstance(v, InListChunks) for v in markers),
+        )
+        if conditional is not None:
+            logger.info("Large IN list on %s: %s values, %s", field, len(value), conditional[1][0])
+        return conditional
 
     def add_conditional_dict(self, conditionDict):
-        logger.info(f"Updating Conditional From Dictionary: {len(conditionDict)}")
+        logger.info("Updating Conditional From Dictionary: %s", len(conditionDict))
         # For adding conditions with a dictionary of values
         # format: searchParameter = {field: (conditional,value)}
         if conditionDict and isinstance(conditionDict, dict):
             for key, value in conditionDict.items():
                 (conditional, data) = value
-                SQLServer.add_conditional(key, conditional, data)
+                self.add_conditional(key, conditional, data)
+
+    def query_builder(self):
+        # Reusable builder seeded with this instance's SQL, dialect and variables, including the
+        # values of conditionals already added to the SQL
+        return QueryBuilder(self.sql, self.dialect, self._query_vars())
+
+    def run_builder(self, builder, valueSets=None):
+        # Runs a QueryBuilder once per value set on a single cursor so the prepared
+        # statement is reused, returns a list of results (one list of dictionaries per set)
+        if valueSets is None:
+            statements = [(builder.sql, builder.vars)]
+        else:
+            statements = (builder.bind(values) for values in valueSets)
+
+        allResults = []
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            for sql, inVars in statements:
+                cursor = self._execute(cursor, sql, inVars)
+                columns = self._columns(cursor)
+                allResults.append([dict(zip(columns, row)) for row in cursor.fetchall()])
+        except Exception as e:
+            self._release(conn, discard=True)
+            logger.error(type(e))
+            logger.error(e, exc_info=True)
+            return
+        self._release(conn)
+        logger.info(f"Query Builder: Ran {len(allResults)} value sets")
+        return allResults
+
+    ###### Bulk Writes ######
+    # examples
+    # db.bulk_insert("testTable", [{"testVarChar": "a", "testInt": 1}, ...])
+    # db.bulk_upsert("testTable", rows, ["testInt"])
+    # db.bulk_execute("UPDATE testTable SET testInt = ? WHERE testVarChar = ?", [(1, "a"), ...])
+    @staticmethod
+    def _bulk_rows(rows, fields):
+        # Returns (fields, iterator of tuples) for an iterable of dictionaries or tuples
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return fields, iter(())
+        if isinstance(first, dict):
+            if not fields:
+                fields = list(first.keys())
+            fieldOrder = list(fields)
+
+            def as_tuples():
+                yield tuple(first.get(f) for f in fieldOrder)
+                for row in rows:
+                    yield tuple(row.get(f) for f in fieldOrder)
+
+            return fields, as_tuples()
+
+        def passthrough():
+            yield tuple(first)
+            for row in rows:
+                yield tuple(row)
+
+        return fields, passthrough()
+
+    def bulk_execute(self, sql, rows, chunkSize=None):
+        # Runs one statement for every row with executemany, committing once per chunk.
+        # Returns {"rows", "chunks", "seconds", "rows_per_sec"} for the rows that were committed and
+        # "error", the exception that stopped the remaining chunks (also kept in self.error) or None
+        if not chunkSize:
+            chunkSize = self.settings["bulk_chunk_size"]
+        logger.info("Bulk Execute: chunk size %s", chunkSize)
+        logger.debug("SQL Statement: %s", sql)
+
+        stats = {"rows": 0, "chunks": 0, "seconds": 0.0, "rows_per_sec": 0.0, "error": None}
+        self.error = None
+        rows = iter(rows)
+        started = time.monotonic()
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            if self.settings["fast_executemany"] and self.dialect.fastExecutemany:
+                # Sends every parameter set of a chunk in a single round trip (Microsoft ODBC drivers)
+                cursor.fast_executemany = True
+
+            while True:
+                chunk = list(islice(rows, chunkSize))
+                if not chunk:
+                    break
+                cursor.executemany(sql, chunk)
+                conn.commit()
+                stats["rows"] += len(chunk)
+                stats["chunks"] += 1
+                logger.debug("Bulk Execute: committed chunk %s", stats["chunks"])
+        except Exception as e:
+            print("Error")
+            self.error = e
+            stats["error"] = e
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            self._release(conn, discard=True)
+            conn = None
+            logger.error(type(e))
+            logger.error(e, exc_info=True)
+        finally:
+            if conn is not None:
+                self._release(conn)
+
+        stats["seconds"] = time.monotonic() - started
+        if stats["seconds"] > 0:
+            stats["rows_per_sec"] = stats["rows"] / stats["seconds"]
+        logger.info(
+            f"Bulk Execute: {stats['rows']} rows in {stats['seconds']:.3f}s ({stats['rows_per_sec']:.0f} rows/sec)"
+        )
+        return stats
+
+    def bulk_insert(self, table, rows, fields=None, chunkSize=None):
+        # rows can be dictionaries (fields default to the keys of the first row) or tuples
+        fields, tuples = SQLServer._bulk_rows(rows, fields)
+        if not fields:
+            logger.error(f"Bulk Insert: no rows or field names for {table}")
+            return
+        sql = insert_statement(table, fields)
+        if sql is None:
+            return
+        return self.bulk_execute(sql, tuples, chunkSize)
+
+    def bulk_upsert(self, table, rows, keyFields, fields=None, chunkSize=None):
+        # Inserts new rows and updates existing rows matched on keyFields
+        fields, tuples = SQLServer._bulk_rows(rows, fields)
+        if not fields:
+            logger.error(f"Bulk Upsert: no rows or field names for {table}")
+            return
+        sql = upsert_statement(self.dialect, table, fields, keyFields)
+        if sql is None:
+            return
+        return self.bulk_execute(sql, tuples, chunkSize)
 
     def conn_parameters(self):
         connectionParams = list()
@@ -226,73 +413,495 @@ class SQLServer:
 
         return {"connection": ";".join(connectionParams) + ";", "details": printableParams}
 
-    def run_query(self):
-        params = self.conn_parameters()
-        if self.vars:
-            self.vars.extend(self._conditionVars)
+    def _get_tracer(self):
+        if self.tracer is not None:
+            return self.tracer
+        return get_global_tracer()
+
+    def _pool(self, params=None):
+        # Pool for this environment, the health check statement comes from the dialect unless
+        # pool_options sets one
+        if params is None:
+            params = self.conn_parameters()
+        options = {"healthCheck": self.dialect.pingQuery}
+        options.update(self.settings["pool_options"])
+        return get_pool(params["connection"], **options)
+
+    def _connect(self, params=None):
+        # Returns an open connection, borrowed from the pool when pooling is enabled
+        if params is None:
+            params = self.conn_parameters()
+        logger.info("Query: Creating Connection")
+        logger.debug(params["details"])
+        tracer = self._get_tracer()
+        started = start_span(tracer)
+        if self.settings["pool"]:
+            pool = self._pool(params)
+            conn = pool.acquire()
+            self._connPools[id(conn)] = pool
         else:
-            self.vars = self._conditionVars
+            # imported on first use so importing gendb does not load the ODBC driver manager
+            import pyodbc
 
-        results = []
+            conn = pyodbc.connect(r"" + params["connection"])
+        conn.timeout = self.settings["timeout"]
+        finish_span(tracer, "connect", started)
+        return conn
+
+    def _release(self, conn, discard=False):
+        # Hands the connection back to the pool, or closes it when pooling is disabled
+        pool = self._connPools.pop(id(conn), None)
+        if pool is not None:
+            pool.release(conn, discard=discard)
+        else:
+            conn.close()
+
+    def pool_stats(self):
+        # hit/miss counts and wait time for the pool used by this environment
+        return self._pool().stats()
+
+    def _query_vars(self):
+        # Positional parameters for the statement: passed in vars followed by the conditionals
+        inVars = list(self.__sqlVars) if self.__sqlVars else []
+        inVars.extend(self._conditionVars)
+        return inVars
 
+    def _execute(self, cursor, sql, inVars, projection=None):
+        # Returns the cursor to read rows from, a ChunkedCursor when an IN list is chunked.
+        # The projection (self.projection unless given) is applied to the final statement
+        sql = project_sql(sql, projection or self.projection)
+        if in_list_markers(inVars):
+            fast = self.settings["fast_executemany"] and self.dialect.fastExecutemany
+            varSets = expand_in_lists(cursor, inVars, fast)
+            if isinstance(varSets, list):
+                self._run_statement(cursor, sql, varSets[0])
+                return cursor
+            if not chunk_safe(sql):
+                raise ValueError(
+                    "A chunked IN list cannot run in a statement with aggregates, DISTINCT,"
+                    " GROUP BY or a row limit"
+                )
+            return ChunkedCursor(cursor, sql, varSets, self._run_statement)
+        self._run_statement(cursor, sql, inVars)
+        return cursor
+
+    def _run_statement(self, cursor, sql, inVars):
+        logger.debug("SQL Statement: %s", sql)
+        logger.debug("SQL Variables: %s", inVars)
+        if self.debug:
+            print("**************** SQL *************** ")
+            print(sql)
+            print("**************** Vars *************** ")
+            print(inVars)
+            print("************************************ ")
+
+        print("Running Query: Executing script")
+        logger.info("Query: Executing SQL Statement")
+        tracer = self._get_tracer()
+        started = start_span(tracer)
+        if inVars:
+            cursor.execute(sql, inVars)
+        else:
+            cursor.execute(sql)
+        finish_span(tracer, "execute", started)
+
+    def _columns(self, cursor):
+        print("Processing the Data: Getting Columns")
+        logger.info("Query: Getting Fieldnames")
+        logger.debug("cursor.description: %s", cursor.description)
+        if self.debug:
+            print(cursor.description)
+        tracer = self._get_tracer()
+        started = start_span(tracer)
+        columns = []
+        # cursor.description of the last statement, type information for typed exports
+        self.description = cursor.description
+        if cursor.description:
+            columns = [column[0] for column in cursor.description]
+        finish_span(tracer, "describe", started)
+        return columns
+
+    def _iter_batches(self, batchSize=None, fields=None):
+        # Yields (columns, rows) with at most batchSize raw rows pulled per round trip (sized by
+        # fetch_budget when set), fields limits the columns selected by the database
+        conn = self._connect()
         try:
-            logger.info(f"Query: Creating Connection")
-            logger.debug(params["details"])
-            # logger.debug(params["connection"])
-            conn = pyodbc.connect(r"" + params["connection"])
-            conn.timeout = self.settings["timeout"]
-            print("Getting Cursor")
             cursor = conn.cursor()
+            inVars = self._query_vars()
+            projection = self._pushdown_projection(cursor, fields, inVars)
+            cursor = self._execute(cursor, self.sql, inVars, projection)
+            columns = self._columns(cursor)
+            logger.info("Query: Streaming Row Data")
+            for rows in self._fetch_batches(cursor, self._get_tracer(), batchSize):
+                yield columns, rows
+        except Exception as e:
+            self._release(conn, discard=True)
+            conn = None
+            logger.error(type(e))
+            logger.error(e, exc_info=True)
+            raise
+        finally:
+            if conn is not None:
+                self._release(conn)
 
-            logger.debug(f"SQL Statement: {self.sql}")
-            logger.debug(f"SQL Variables: {self.vars}")
-            if self.debug:
-                print("**************** SQL *************** ")
-                print(self.sql)
-                print("**************** Vars *************** ")
-                print(self.vars)
-                print("************************************ ")
-
-            print("Running Query: Executing script")
-            logger.info(f"Query: Executing SQL Statement")
-            if self.vars:
-                cursor.execute(self.sql, self.vars)
+    def _pushdown_projection(self, cursor, fields, inVars):
+        # Projection selecting only fields (names after self.projection), None to keep the default.
+        # Fields the query does not return are left out, the exporters skip them as before
+        if not fields:
+            return None
+        if self.projection:
+            byName = {alias or field: (field, alias) for field, alias in self.projection}
+            return [byName[f] for f in fields if f in byName] or None
+        sourceColumns = self._source_columns(cursor, inVars)
+        if sourceColumns is None:
+            return None
+        return projection_list([f for f in fields if f in sourceColumns]) or None
+
+    def _source_columns(self, cursor, inVars):
+        # Column names of self.sql from a statement returning no rows, None when it can not be
+        # described (the query is then run without a projection)
+        try:
+            describeCursor = self._execute(cursor, describe_sql(self.sql), inVars)
+            return [column[0] for column in describeCursor.description or []]
+        except Exception as e:
+            logger.warning("Query: Projection not pushed down, columns not described: %s", e)
+            return None
+
+    def iter_query(self, batchSize=None, batches=False):
+        # Lazily yields row dictionaries (or lists of them when batches=True),
+        # memory use is bounded by batchSize instead of the full result
+        for columns, rows in self._iter_batches(batchSize):
+            if batches:
+                yield [dict(zip(columns, row)) for row in rows]
             else:
-                cursor.execute(self.sql)
+                for row in rows:
+                    yield dict(zip(columns, row))
+
+    def _fetch_batches(self, cursor, tracer, batchSize=None):
+        # Yields fetchmany batches, sized from fetch_budget when set, and keeps their stats
+        sizer = BatchSizer(
+            self.settings["fetch_budget"],
+            cursor.description,
+            batchSize or self.settings["batch_size"],
+        )
+        self.fetch_stats = sizer.stats()
+        logger.debug("Query: First fetch batch: %s rows", sizer.size)
+        try:
+            while True:
+                started = start_span(tracer)
+                rows = cursor.fetchmany(sizer.size)
+                if not rows:
+                    break
+                batchBytes = sizer.observe(rows)
+                finish_span(tracer, "fetch", started, len(rows), batchBytes)
+                yield rows
+        finally:
+            self.fetch_stats = sizer.stats()
+            logger.info(
+                "Query: Fetched %s rows in %s batches, peak %s bytes, average %s bytes",
+                self.fetch_stats["rows"],
+                self.fetch_stats["batches"],
+                self.fetch_stats["peak_bytes"],
+                self.fetch_stats["avg_bytes"],
+            )
+
+    def _fill_batches(self, cursor, results, tracer):
+        # Loads a result container (append_rows) one fetchmany batch at a time
+        for rows in self._fetch_batches(cursor, tracer):
+            started = start_span(tracer)
+            results.append_rows(rows)
+            finish_span(tracer, "transform", started, len(rows))
+
+    def _cache_key(self, params):
+        # (connection, sql, parameters, result format), None when caching is off or not possible
+        if self.settings["cache"] is None or self.settings["spill"]:
+            # spilled results live in a temporary file owned by this instance
+            return None
+        key = (
+            params["connection"],
+            self.sql,
+            tuple(self._query_vars()),
+            bool(self.settings["columnar"]),
+            bool(self.settings["numpy"]),
+            tuple(self.projection or ()),
+            self.settings["row_factory"],
+        )
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
 
-            print("Processing the Data: Getting Columns")
-            logger.info(f"Query: Getting Fieldnames")
-            logger.debug(f"cursor.description: {cursor.description}")
-            if self.debug:
-                print(cursor.description)
-            columns = []
-            if cursor.description:
-                columns = [column[0] for column in cursor.description]
+    def paginate(self, order_by, page_size=None, token=None):
+        # Yields Page objects (lists of row dictionaries) using keyset pagination on order_by,
+        # page.token can be passed back in later (even from another process) to resume
+        # examples
+        # for page in db.paginate("testInt", page_size=500): ...
+        # for page in db.paginate(["testVarChar DESC", "testInt"], token=savedToken): ...
+        orderFields = parse_order_by(order_by)
+        if not orderFields:
+            return
+        if self.projection:
+            # the keyset predicate and the next token read the order fields by their own names
+            kept = [field for field, alias in self.projection if alias is None]
+            missing = [field for field, _ in orderFields if field not in kept]
+            if missing:
+                raise ValueError(
+                    f"paginate: order fields {missing} are not projected under their own names"
+                )
+        if not page_size:
+            page_size = self.settings["batch_size"]
+
+        lastValues = None
+        number = 0
+        if token:
+            decoded = decode_token(token, orderFields)
+            if decoded is None:
+                raise ValueError("paginate: invalid page token or token for another order by")
+            lastValues, number = decoded
+
+        orderStr = order_clause(orderFields)
+        baseVars = self._query_vars()
+        if any(isinstance(v, InListChunks) for v in baseVars):
+            # every chunk would return its own first page
+            raise ValueError("paginate does not support chunked IN lists")
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            while True:
+                sql = self.sql
+                inVars = list(baseVars)
+                if lastValues is not None:
+                    predicate, keyVars = keyset_predicate(orderFields, lastValues)
+                    sql = f"{sql} AND {predicate}"
+                    inVars.extend(keyVars)
+                inVars.append(page_size)
+
+                pageCursor = self._execute(cursor, sql + orderStr + self.dialect.paging, inVars)
+                columns = self._columns(pageCursor)
+                rows = [dict(zip(columns, row)) for row in pageCursor.fetchall()]
+                number += 1
+
+                if len(rows) < page_size:
+                    logger.info("Paginate: last page %s with %s rows", number, len(rows))
+                    if rows:
+                        yield Page(rows, None, number)
+                    break
+
+                lastValues = [rows[-1][field] for field, _ in orderFields]
+                yield Page(rows, encode_token(orderFields, lastValues, number), number)
+        except Exception as e:
+            self._release(conn, discard=True)
+            conn = None
+            logger.error(type(e))
+            logger.error(e, exc_info=True)
+            raise
+        finally:
+            if conn is not None:
+                self._release(conn)
+
+    def project(self, fields, renames=None):
+        # Selects only fields (renamed with {"Old_Name": "New_Name"}) in the SQL itself instead of
+        # dropping columns after the fetch. Applies to every later query, project(None) clears it.
+        # Fields used by refresh or conditionals after the query must stay projected, paginate
+        # raises a ValueError when an order field is renamed or left out
+        # examples
+        # db.project(["testInt", "testVarChar"])
+        # db.project(["testInt"], {"testInt": "rename1"})
+        logger.info("Projecting Fields: %s %s", fields, renames)
+        if not fields:
+            self.projection = None
+            return True
+        projection = projection_list(fields, renames)
+        if projection is None:
+            return False
+        self.projection = projection
+        return True
+
+    def refresh(self, watermark, keyFields, stateFile=None, inclusive=False, full=False):
+        # Incremental refresh: fetches rows with watermark past the last high-water mark and
+        # upserts them into self.result by keyFields. The first call (or full=True) loads every
+        # row. Rows deleted at the source are not detected. Returns
+        # {"rows", "inserted", "updated", "watermark"} or None when the query failed or does not
+        # return the watermark and key fields.
+        # examples
+        # db.refresh("updated_at", ["id"], stateFile="orders.state.json")
+        # db.refresh("rowVersion", ["orderId", "lineId"])
+        # inclusive=True re-reads rows equal to the mark, for timestamps that are not unique
+        if isinstance(keyFields, str):
+            keyFields = [keyFields]
+        if not valid_field(watermark) or not all(valid_field(k) for k in keyFields):
+            return None
+
+        mark = None
+        if not full:
+            mark = self.watermark
+            if mark is None and stateFile:
+                mark = load_watermark(stateFile, watermark)
+
+        sql = self.sql
+        inVars = self._query_vars()
+        if mark is not None:
+            sql = f"{sql} AND {watermark} {'>=' if inclusive else '>'} ?"
+            inVars.append(mark)
+        logger.info(f"Refresh: {watermark} past {mark}")
+
+        self.error = None
+        conn = self._connect()
+        try:
+            cursor = self._execute(conn.cursor(), sql, inVars)
+            columns = self._columns(cursor)
+            # a missing field would give every row the key None and merge them into one
+            missing = [f for f in [watermark] + keyFields if f not in columns]
+            fetched = None if missing else cursor.fetchall()
+        except Exception as e:
+            self.error = e
+            self._release(conn, discard=True)
+            logger.error(type(e))
+            logger.error(e, exc_info=True)
+            return None
+        self._release(conn)
+        if missing:
+            logger.error(f"Error! Refresh fields not returned by the query: {missing}")
+            return None
+
+        # new rows are built in the format of the result they are merged into
+        rowFormat = self.settings["row_factory"]
+        if mark is None:
+            result = RowList(columns, rowFormat) if rowFormat != "dict" else list()
+        elif isinstance(self.result, RowList) and self.result.columns == columns:
+            result = self.result
+            rowFormat = result.rowFormat
+        elif isinstance(self.result, list) and not isinstance(self.result, RowList):
+            result = self.result
+            rowFormat = "dict"
+        else:
+            # columnar and numpy results (or other columns) continue as row dictionaries
+            result = list(iter_dicts(self.result))
+            rowFormat = "dict"
+        factory = row_factory(rowFormat, columns)
+        rows = [factory(row) for row in fetched]
+        if rowFormat != "dict":
+            rows = RowList(columns, rowFormat, rows)
+        inserted, updated = merge_rows(result, rows, keyFields)
+        # assigned again so indexes built on the previous result are dropped
+        self.result = result
+
+        self.watermark = max_watermark(rows, watermark, mark)
+        if stateFile and self.watermark is not None:
+            save_watermark(stateFile, watermark, keyFields, self.watermark)
+        logger.info(
+            f"Refresh: {len(rows)} rows, {inserted} inserted, {updated} updated, watermark {self.watermark}"
+        )
+        return {
+            "rows": len(rows),
+            "inserted": inserted,
+            "updated": updated,
+            "watermark": self.watermark,
+        }
+
+    def run_query(self, stream=False):
+        if stream:
+            return self.iter_query()
+
+        params = self.conn_parameters()
+        # built on every run, self.vars is not extended so the instance can run again
+        inVars = self._query_vars()
+
+        results = []
+        self.error = None
+
+        cacheKey = self._cache_key(params)
+        if cacheKey is not None:
+            hit, cached = self.settings["cache"].get(cacheKey)
+            if hit:
+                logger.info("Query: Result Cache Hit: %s rows", len(cached))
+                self.result = copy_result(cached)
+                return
+
+        conn = None
+        try:
+            conn = self._connect(params)
+            print("Getting Cursor")
+            cursor = conn.cursor()
+
+            cursor = self._execute(cursor, self.sql, inVars)
+            columns = self._columns(cursor)
 
             print("Processing the Data: Looping over returned results")
-            logger.info(f"Query: Getting Row Data")
-            for row in cursor.fetchall():
-                if self.debug:
-                    print(row)
-                results.append(dict(zip(columns, row)))
+            logger.info("Query: Getting Row Data")
+            tracer = self._get_tracer()
+            if self.settings["numpy"]:
+                # numpy is optional, only imported when this result mode is used
+                from .npresult import NumpyResult
+
+                results = NumpyResult.from_description(
+                    self.description or [], self.settings["batch_size"]
+                )
+                self._fill_batches(cursor, results, tracer)
+                results.finish()
+            elif self.settings["spill"]:
+                from .spill import SpillResult
+
+                results = SpillResult(
+                    columns, self.settings["spill_budget"], self.settings["spill_dir"]
+                )
+                self._fill_batches(cursor, results, tracer)
+                if results.spilled:
+                    logger.info(
+                        "Query: %s of %s rows spilled to disk", results.spilled, len(results)
+                    )
+            elif self.settings["columnar"]:
+                results = ColumnarResult(columns)
+                self._fill_batches(cursor, results, tracer)
+            else:
+                rowFormat = self.settings["row_factory"]
+                if rowFormat != "dict":
+                    results = RowList(columns, rowFormat)
+                factory = row_factory(rowFormat, columns)
+                if self.settings["fetch_budget"]:
+                    # batches sized by the budget, only one batch of raw rows is held at a time
+                    batches = self._fetch_batches(cursor, tracer)
+                else:
+                    started = start_span(tracer)
+                    rows = cursor.fetchall()
+                    sizer = BatchSizer(None, cursor.description, len(rows))
+                    finish_span(tracer, "fetch", started, len(rows), sizer.observe(rows))
+                    self.fetch_stats = sizer.stats()
+                    batches = [rows]
+                for rows in batches:
+                    started = start_span(tracer)
+                    for row in rows:
+                        if self.debug:
+                            print(row)
+                        results.append(factory(row))
+                    finish_span(tracer, "transform", started, len(rows))
 
             if not results:
                 print("Result: No results returned")
-                logger.info(f"Total Result Count: 0")
+                logger.info("Total Result Count: 0")
             else:
                 print("Result: Total Count: " + str(len(results)))
-                logger.info(f"Total Result Count: {len(results)}")
+                logger.info("Total Result Count: %s", len(results))
                 if self.debug:
                     print("Index 0 below:")
                     print(results[0])
 
             print("Closing the connection")
-            conn.close()
+            self._release(conn)
+            conn = None
 
             self.result = results
+            if cacheKey is not None:
+                self.settings["cache"].put(
+                    cacheKey, copy_result(results), tags=self.settings["cache_tags"]
+                )
 
         except Exception as e:
             print("Error")
+            self.error = e
+            if conn is not None:
+                self._release(conn, discard=True)
             logger.error(type(e))
             logger.error(e, exc_info=True)
             return
@@ -301,6 +910,8 @@ class SQLServer:
         try:
             if len(self.result) == 0:
                 return None
+            elif isinstance(self.result, RowList):
+                return self.result.columns
             else:
                 iter(self.result)
                 iter(self.result[0])
@@ -312,12 +923,19 @@ class SQLServer:
 
     def get_field_data(self, field):
         # Returns a list of data from a specific field
-        logger.info(f"Getting Field data for: {field}")
+        logger.info("Getting Field data for: %s", field)
+        if not isinstance(self.result, list) or isinstance(self.result, RowList):
+            # ColumnarResult / NumpyResult: the stored column, no copy
+            if len(self.result) > 1:
+                return self.result.column(field)
+            return None
         if len(self.result) > 1 and field in self.result[0]:
             return [d[field] for d in self.result if field in d]
 
     def select_fields(self, fieldList):
-        logger.info(f"Selecting Fields: {fieldList}")
+        logger.info("Selecting Fields: %s", fieldList)
+        if not isinstance(self.result, list) or isinstance(self.result, RowList):
+            return self.result.select(fieldList)
         newList = list()
         for inD in self.result:
             modDict = dict((k, inD[k]) for k in fieldList if k in inD)
@@ -325,8 +943,12 @@ class SQLServer:
         return newList
 
     def rename_fields(self, keyDict):
-        logger.info(f"Renaming Fields: {keyDict}")
+        logger.info("Renaming Fields: %s", keyDict)
         # keyDict = {"Old_Name": "New_Name"}
+        if not isinstance(self.result, list) or isinstance(self.result, RowList):
+            self.result = self.result.rename(keyDict)
+            return
+
         def rename_keys(d, keys):
             return dict([(keys.get(k, k), v) for k, v in d.items()])
 
@@ -336,6 +958,41 @@ class SQLServer:
             newList.append(newDict)
         self.result = newList
 
+    ###### Indexes ######
+    # Built lazily on the first lookup and dropped whenever self.result is replaced
+    # (run_query, rename_fields). Changing the rows of a list result in place is not
+    # detected, call drop_indexes() afterwards.
+    # db.lookup("testInt", 30)
+    # db.lookup(["testVarChar", "testInt"], ("vc30", 30))
+    # db.range_lookup("testInt", 20, 40)
+    def get_index(self, fields, kind="hash"):
+        if isinstance(fields, str):
+            fields = [fields]
+        indexKey = (kind, tuple(fields))
+        index = self.__indexes.get(indexKey)
+        if index is None:
+            index = build_index(self.result, fields, kind)
+            if index is not None:
+                self.__indexes[indexKey] = index
+        return index
+
+    def drop_indexes(self):
+        self.__indexes = dict()
+
+    def lookup(self, fields, value):
+        # Rows where fields == value, value is a tuple when several fields are given
+        index = self.get_index(fields, "hash")
+        if index is None:
+            return []
+        return [self.result[pos] for pos in index.lookup(value)]
+
+    def range_lookup(self, fields, low=None, high=None, includeLow=True, includeHigh=True):
+        # Rows with low <= fields <= high ordered by fields, rows with NULL keys are skipped
+        index = self.get_index(fields, "sorted")
+        if index is None:
+            return []
+        return [self.result[pos] for pos in index.range(low, high, includeLow, includeHigh)]
+
     def export_csv(self, fullFilePath, selectedFields=None):
         # export results as a CSV with the ability to export selected fields
         outputFileNameLoc = Path(fullFilePath).with_suffix(".csv")
@@ -348,6 +1005,11 @@ class SQLServer:
         else:
             res = self.result
         with open(outputFileNameLoc, "w", encoding="utf8", newline="") as output_file:
+            if isinstance(res, RowList):
+                writer = csv.writer(output_file)
+                writer.writerow(res.columns)
+                writer.writerows(res)
+                return
             dict_writer = csv.DictWriter(output_file, res[0].keys())
             dict_writer.writeheader()
             dict_writer.writerows(res)
@@ -364,4 +1026,204 @@ class SQLServer:
         else:
             res = self.result
         with open(outputFileNameLoc, "w") as outfile:
-            json.dump(res, outfile, cls=DateTimeEncoder)
+            if isinstance(res, list) and not isinstance(res, RowList):
+                json.dump(res, outfile, cls=DateTimeEncoder)
+            else:
+                # Encode row by row so columnar results are never expanded into a full list
+                outfile.write("[")
+                for i, row in enumerate(iter_dicts(res)):
+                    if i:
+                        outfile.write(", ")
+                    json.dump(row, outfile, cls=DateTimeEncoder)
+                outfile.write("]")
+
+    def export_ndjson(self, fullFilePath, selectedFields=None):
+        # Export into newline delimited json (one object per line) with the ability to export selected fields
+        outputFileNameLoc = Path(fullFilePath).with_suffix(".ndjson")
+        print(f"Printing to file: {outputFileNameLoc}")
+        logger.info(f"Exporting NDJSON File: {outputFileNameLoc}")
+        logger.info(f"Exporting NDJSON Selected Fields: {selectedFields}")
+
+        if selectedFields:
+            res = SQLServer.select_fields(self, selectedFields)
+        else:
+            res = self.result
+        with open(outputFileNameLoc, "w", encoding="utf8") as outfile:
+            for row in iter_dicts(res):
+                outfile.write(json.dumps(row, cls=DateTimeEncoder) + "\n")
+
+    ###### Streaming Exports ######
+    # Run the query and write rows straight from the cursor, one batch in memory at a time
+    @staticmethod
+    def _selected_positions(columns, selectedFields):
+        if not selectedFields:
+            return list(range(len(columns)))
+        return [columns.index(f) for f in selectedFields if f in columns]
+
+    def stream_csv(self, fullFilePath, selectedFields=None, batchSize=None):
+        outputFileNameLoc = Path(fullFilePath).with_suffix(".csv")
+        print(f"Streaming to file: {outputFileNameLoc}")
+        logger.info(f"Streaming CSV File: {outputFileNameLoc}")
+        logger.info(f"Streaming CSV Selected Fields: {selectedFields}")
+
+        total = 0
+        with open(outputFileNameLoc, "w", encoding="utf8", newline="") as output_file:
+            writer = csv.writer(output_file)
+            positions = None
+            for columns, rows in self._iter_batches(batchSize, selectedFields):
+                if positions is None:
+                    positions = SQLServer._selected_positions(columns, selectedFields)
+                    writer.writerow([columns[p] for p in positions])
+                writer.writerows([[row[p] for p in positions] for row in rows])
+                total += len(rows)
+
+        logger.info(f"Streaming CSV Row Count: {total}")
+        return total
+
+    def stream_ndjson(self, fullFilePath, selectedFields=None, batchSize=None):
+        outputFileNameLoc = Path(fullFilePath).with_suffix(".ndjson")
+        print(f"Streaming to file: {outputFileNameLoc}")
+        logger.info(f"Streaming NDJSON File: {outputFileNameLoc}")
+        logger.info(f"Streaming NDJSON Selected Fields: {selectedFields}")
+
+        total = 0
+        encoder = DateTimeEncoder()
+        with open(outputFileNameLoc, "w", encoding="utf8") as outfile:
+            positions = None
+            for columns, rows in self._iter_batches(batchSize, selectedFields):
+                if positions is None:
+                    positions = SQLServer._selected_positions(columns, selectedFields)
+                    names = [columns[p] for p in positions]
+                lines = [
+                    encoder.encode(dict(zip(names, [row[p] for p in positions]))) for row in rows
+                ]
+                outfile.write("\n".join(lines) + "\n")
+                total += len(rows)
+
+        logger.info(f"Streaming NDJSON Row Count: {total}")
+        return total
+
+    def _stream_arrow(
+        self, fullFilePath, fmt, selectedFields, batchSize, compression, rowGroupSize=None
+    ):
+        # optional export modules are imported on first use to keep "import gendb.db" fast
+        from .arrow import ArrowFileWriter, arrow_schema, import_pyarrow, record_batch
+
+        pa = import_pyarrow()
+        if pa is None:
+            return
+
+        suffix = ".parquet" if fmt == "parquet" else ".arrow"
+        outputFileNameLoc = Path(fullFilePath).with_suffix(suffix)
+        print(f"Streaming to file: {outputFileNameLoc}")
+        logger.info(f"Streaming {fmt} File: {outputFileNameLoc}")
+        logger.info(f"Streaming {fmt} Selected Fields: {selectedFields}")
+
+        total = 0
+        writer = None
+        try:
+            for columns, rows in self._iter_batches(batchSize, selectedFields):
+                if writer is None:
+                    positions = SQLServer._selected_positions(columns, selectedFields)
+                    schema = arrow_schema(pa, self.description, positions)
+                    writer = ArrowFileWriter(
+                        pa, outputFileNameLoc, schema, fmt, compression, rowGroupSize
+                    )
+                writer.write(record_batch(pa, schema, rows, positions))
+                total += len(rows)
+
+            if writer is None and self.description:
+                # No rows returned, still write a file with the schema
+                columns = [c[0] for c in self.description]
+                positions = SQLServer._selected_positions(columns, selectedFields)
+                schema = arrow_schema(pa, self.description, positions)
+                writer = ArrowFileWriter(
+                    pa, outputFileNameLoc, schema, fmt, compression, rowGroupSize
+                )
+        finally:
+            if writer is not None:
+                writer.close()
+
+        logger.info(f"Streaming {fmt} Row Count: {total}")
+        return total
+
+    def stream_arrow(self, fullFilePath, selectedFields=None, batchSize=None, compression=None):
+        # Arrow IPC file, compression can be "lz4" or "zstd" (requires pyarrow)
+        return self._stream_arrow(fullFilePath, "arrow", selectedFields, batchSize, compression)
+
+    def stream_parquet(
+        self,
+        fullFilePath,
+        selectedFields=None,
+        batchSize=None,
+        compression=None,
+        rowGroupSize=None,
+    ):
+        # Parquet file, compression defaults to "snappy", row groups of rowGroupSize rows
+        # (128k by default) (requires pyarrow)
+        return self._stream_arrow(
+            fullFilePath, "parquet", selectedFields, batchSize, compression, rowGroupSize
+        )
+
+    def export_parts(
+        self,
+        outputDir,
+        fmt="csv",
+        compression="gzip",
+        partRows=1000000,
+        partitionField=None,
+        selectedFields=None,
+        maxWorkers=None,
+        batchSize=None,
+        maxBufferedRows=None,
+    ):
+        # Runs the query and writes part files of at most partRows rows (one folder per value of
+        # partitionField when given), encoded and compressed by worker threads while fetching
+        # continues. fmt: "csv" or "ndjson", compression: "gzip", "zstd" or None.
+        # Returns the manifest written to outputDir/manifest.json
+        print(f"Exporting parts to: {outputDir}")
+        logger.info(f"Exporting {fmt} parts: {outputDir} compression {compression}")
+        logger.info(f"Exporting Parts Selected Fields: {selectedFields}")
+        from .export import PartitionedExport
+
+        exporter = PartitionedExport(
+            outputDir,
+            fmt,
+            compression,
+            partRows,
+            partitionField,
+            maxWorkers,
+            encoder=DateTimeEncoder(),
+            maxBufferedRows=maxBufferedRows,
+        )
+        pushdown = None
+        if selectedFields:
+            pushdown = list(selectedFields)
+            if partitionField is not None and partitionField not in pushdown:
+                pushdown.append(partitionField)
+        try:
+            positions = None
+            for columns, rows in self._iter_batches(batchSize, pushdown):
+                if positions is None:
+                    positions = SQLServer._selected_positions(columns, selectedFields)
+                    names = [columns[p] for p in positions]
+                    partitionPos = None
+                    if partitionField is not None:
+                        if partitionField not in columns:
+                            raise ValueError(f"Partition field not in the result: {partitionField}")
+                        partitionPos = columns.index(partitionField)
+                partitions = None
+                if partitionPos is not None:
+                    partitions = [row[partitionPos] for row in rows]
+                exporter.add_rows(names, [[row[p] for p in positions] for row in rows], partitions)
+        except Exception as e:
+            exporter.abort()
+            logger.error(type(e))
+            logger.error(e, exc_info=True)
+            raise
+
+        columns = [c[0] for c in self.description or []]
+        positions = SQLServer._selected_positions(columns, selectedFields)
+        manifest = exporter.finish([columns[p] for p in positions])
+        logger.info(f"Exporting Parts: {manifest['rows']} rows in {len(manifest['parts'])} parts")
+        return manifest
@@ -0,0 +1,167 @@
+# Python Libaries
+import re
+import threading
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Example Usage
+# dialect = resolve_dialect("{ODBC Driver 17 for SQL Server}")
+# dialect.name                             # "sqlserver"
+# dialect.numeric_field("testInt", "int")  # "ISNUMERIC(testInt) = 1 AND TRY_CONVERT(bigint, testInt)"
+# dialect.paging                           # " OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY"
+#
+# New databases are added with register_dialect(Dialect(...)), the newest registration wins
+###
+
+
+class Dialect:
+    def __init__(
+        self,
+        name,
+        pattern,
+        numericCheck=None,
+        casts=None,
+        paging=" LIMIT ?",
+        maxParams=999,
+        upsert=None,
+        fastExecutemany=False,
+        tempTable=None,
+        pingQuery="SELECT 1",
+    ):
+        self.name = name
+        self.pattern = pattern  # regular expression searched in env["driver"]
+        self.numericCheck = numericCheck  # "{field}" template guarding numeric casts, or None
+        self.casts = dict(casts or {})  # {"int": template, "float": template}, default is the field
+        self.paging = paging  # appended after ORDER BY, with one "?" for the row limit
+        self.maxParams = maxParams  # bound parameters allowed in a single statement
+        self.upsert = upsert  # "merge", "on_conflict" or None
+        self.fastExecutemany = fastExecutemany  # driver supports pyodbc fast_executemany
+        # {"name": "#{name}", "create": "CREATE TABLE {table} (v {type})", "types": {kind: type}}
+        # used to hold large IN lists, None splits them into chunked statements instead
+        self.tempTable = tempTable
+        self.pingQuery = pingQuery  # cheap statement used by the connection pool health check
+
+    def __repr__(self):
+        return f"Dialect({self.name})"
+
+    def matches(self, inDriver):
+        return re.search(self.pattern, inDriver or "") is not None
+
+    def numeric_check(self, field):
+        if self.numericCheck is None:
+            return None
+        return self.numericCheck.format(field=field)
+
+    def cast(self, field, kind):
+        template = self.casts.get(kind)
+        if template is None:
+            return field
+        return template.format(field=field)
+
+    def numeric_field(self, field, kind):
+        # Field expression used when comparing against an int or float value
+        numCheckStr = self.numeric_check(field)
+        numConvertStr = self.cast(field, kind)
+        if numCheckStr != None:
+            return "{} AND {}".format(numCheckStr, numConvertStr)
+        return numConvertStr
+
+
+generic = Dialect("generic", "", paging=" LIMIT ?", maxParams=999)
+
+_dialects = [
+    Dialect(
+        "sqlserver",
+        "SQL Server",
+        numericCheck="ISNUMERIC({field}) = 1",
+        casts={"int": "TRY_CONVERT(bigint, {field})", "float": "TRY_CONVERT(dec(38,2), {field})"},
+        paging=" OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY",
+        maxParams=2100,
+        upsert="merge",
+        fastExecutemany=True,
+        tempTable={
+            "name": "#{name}",
+            "create": "CREATE TABLE {table} (v {type})",
+            "types": {
+                "int": "BIGINT",
+                "float": "FLOAT",
+                "decimal": "DECIMAL(38,10)",
+                # the database's collation, not tempdb's, so comparisons with its columns work
+                "str": "NVARCHAR(4000) COLLATE DATABASE_DEFAULT",
+                "text": "NVARCHAR(MAX) COLLATE DATABASE_DEFAULT",
+                "datetime": "DATETIME2",
+                "date": "DATE",
+                "bytes": "VARBINARY(MAX)",
+            },
+        },
+    ),
+    Dialect(
+        "sqlite",
+        "SQLite",
+        # "(typeof({field}) = 'integer' OR typeof({field}) = 'real')" would skip text values
+        casts={"int": "CAST({field} AS INT)", "float": "CAST({field} AS REAL)"},
+        paging=" LIMIT ?",
+        maxParams=999,
+        upsert="on_conflict",
+        # untyped column, values compare the same way bound parameters do
+        tempTable={"name": "temp.{name}", "create": "CREATE TABLE {table} (v)", "types": None},
+    ),
+    Dialect(
+        "postgresql",
+        "PostgreSQL",
+        paging=" LIMIT ?",
+        maxParams=32767,
+        upsert="on_conflict",
+        tempTable={
+            "name": "pg_temp.{name}",
+            "create": "CREATE TABLE {table} (v {type})",
+            "types": {
+                "int": "BIGINT",
+                "float": "DOUBLE PRECISION",
+                "decimal": "NUMERIC",
+                "str": "TEXT",
+                "datetime": "TIMESTAMP",
+                "date": "DATE",
+                "bytes": "BYTEA",
+            },
+        },
+    ),
+    Dialect(
+        "oracle",
+        "Oracle",
+        paging=" FETCH FIRST ? ROWS ONLY",
+        maxParams=1000,
+        pingQuery="SELECT 1 FROM DUAL",
+    ),
+]
+_resolved = dict()
+_lock = threading.Lock()
+
+
+def register_dialect(dialect):
+    with _lock:
+        _dialects.insert(0, dialect)
+        _resolved.clear()
+    logger.info(f"Registered SQL Dialect: {dialect.name}")
+
+
+def get_dialect(name):
+    for dialect in _dialects:
+        if dialect.name == name:
+            return dialect
+    return None
+
+
+def resolve_dialect(inDriver):
+    # The driver string is matched once, later lookups are a dictionary hit
+    dialect = _resolved.get(inDriver)
+    if dialect is not None:
+        return dialect
+    with _lock:
+        dialect = next((d for d in _dialects if d.matches(inDriver)), generic)
+        _resolved[inDriver] = dialect
+    return dialect
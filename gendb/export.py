@@ -0,0 +1,217 @@
+# Python Libaries
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Partitioned export
+# Rows are collected into parts of partRows rows (per partition value when partitionField is
+# set). Each full part is encoded, compressed and written by a worker thread while the caller
+# keeps fetching. Encoding rows to CSV/NDJSON holds the GIL like the fetch does, only gzip/zstd
+# compression, hashing and file writes release it and run in parallel. At most two parts per
+# worker are queued, the caller waits when they are all busy.
+#
+# outputDir/part-00000.csv.gz
+# outputDir/testVarChar=vc10/part-00000.csv.gz   (partitionField="testVarChar")
+# outputDir/manifest.json   {"rows": ..., "parts": [{"file", "rows", "bytes", "sha256", ...}]}
+#
+# zstd compression needs the zstandard package: pip install gendb[zstd]
+
+suffixes = {"csv": ".csv", "ndjson": ".ndjson", None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        logger.error("Error! zstd compression requires zstandard: pip install gendb[zstd]")
+        return None
+    return zstandard
+
+
+def partition_name(field, value):
+    # field=value folder, anything but letters, digits, "-" and "." is replaced
+    if value is None:
+        return f"{field}=null"
+    return f"{field}=" + re.sub(r"[^\w.-]", "_", str(value))
+
+
+def encode_part(fmt, names, rows, encoder):
+    if fmt == "csv":
+        buffer = io.StringIO(newline="")
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        writer.writerows(rows)
+        return buffer.getvalue().encode("utf8")
+    lines = [encoder.encode(dict(zip(names, row))) for row in rows]
+    return ("\n".join(lines) + "\n").encode("utf8")
+
+
+def compress_part(data, compression, level=None):
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=level or 6)
+    if compression == "zstd":
+        zstandard = import_zstandard()
+        return zstandard.ZstdCompressor(level=level or 3).compress(data)
+    return data
+
+
+class PartitionedExport:
+    def __init__(
+        self,
+        outputDir,
+        fmt="csv",
+        compression="gzip",
+        partRows=1000000,
+        partitionField=None,
+        maxWorkers=None,
+        encoder=None,
+        level=None,
+        maxBufferedRows=None,
+    ):
+        if fmt not in ("csv", "ndjson"):
+            raise ValueError(f"PartitionedExport: unsupported format {fmt}")
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"PartitionedExport: unsupported compression {compression}")
+        if compression == "zstd" and import_zstandard() is None:
+            raise ImportError("zstd compression requires zstandard")
+        self.outputDir = Path(outputDir)
+        self.outputDir.mkdir(parents=True, exist_ok=True)
+        self.fmt = fmt
+        self.compression = compression
+        self.partRows = partRows
+        self.partitionField = partitionField
+        # rows held across every partition buffer, the largest buffer is written as a smaller part
+        # when there are more, so many distinct partition values can not grow memory without bound
+        self.maxBufferedRows = max(maxBufferedRows or 2 * partRows, 1)
+        self.maxWorkers = maxWorkers or min(4, os.cpu_count() or 1)
+        self.encoder = encoder or json.JSONEncoder()
+        self.level = level
+        self.names = None
+        self.parts = list()
+        self._buffers = dict()  # partition value -> rows waiting for a full part
+        self._buffered = 0  # rows in all buffers
+        self._partNumbers = dict()  # partition folder -> next part number
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.maxWorkers, thread_name_prefix="gendb-export"
+        )
+
+    ###### Methods ######
+    def add_rows(self, names, rows, partitions=None):
+        # rows are sequences in names order, partitions holds the partition value of each row
+        if self.names is None:
+            self.names = list(names)
+        if partitions is None:
+            self._add(None, rows)
+            return
+        grouped = dict()
+        for value, row in zip(partitions, rows):
+            grouped.setdefault(value, []).append(row)
+        for value, partRows in grouped.items():
+            self._add(value, partRows)
+
+    def _add(self, partition, rows):
+        buffer = self._buffers.setdefault(partition, [])
+        buffer.extend(rows)
+        self._buffered += len(rows)
+        while len(buffer) >= self.partRows:
+            self._submit(partition, buffer[: self.partRows])
+            del buffer[: self.partRows]
+            self._buffered -= self.partRows
+        while self._buffered > self.maxBufferedRows:
+            largest = max(self._buffers, key=lambda p: len(self._buffers[p]))
+            buffer = self._buffers.pop(largest)
+            self._buffered -= len(buffer)
+            self._submit(largest, buffer)
+
+    def _submit(self, partition, rows):
+        # Waits for a worker when too many parts are queued, keeps memory bounded
+        while len(self._pending) >= self.maxWorkers * 2:
+            done, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+
+        folder = ""
+        if self.partitionField is not None:
+            folder = partition_name(self.partitionField, partition)
+        # numbered per folder, two values can share a folder once their names are cleaned
+        number = self._partNumbers.get(folder, 0)
+        self._partNumbers[folder] = number + 1
+        fileName = f"part-{number:05d}{suffixes[self.fmt]}{suffixes[self.compression]}"
+        relPath = Path(folder) / fileName
+        self._pending.add(self._executor.submit(self._write_part, relPath, partition, rows))
+
+    def _write_part(self, relPath, partition, rows):
+        data = compress_part(
+            encode_part(self.fmt, self.names, rows, self.encoder), self.compression, self.level
+        )
+        path = self.outputDir / relPath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # written under a temporary name so a failed export never leaves a complete looking part
+        tmpPath = path.with_name(path.name + ".tmp")
+        with open(tmpPath, "wb") as fd:
+            fd.write(data)
+        os.replace(tmpPath, path)
+
+        part = {
+            "file": relPath.as_posix(),
+            "rows": len(rows),
+            "bytes": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+        if self.partitionField is not None:
+            part["partition"] = partition
+        with self._lock:
+            self.parts.append(part)
+        logger.debug(f"Export part written: {part['file']} ({part['rows']} rows)")
+
+    def finish(self, names=None):
+        # Writes the remaining partial parts and the manifest, returns the manifest.
+        # names is only used when no rows were added
+        if self.names is None:
+            self.names = list(names or [])
+        try:
+            for partition, buffer in self._buffers.items():
+                if buffer:
+                    self._submit(partition, buffer)
+            self._buffers = dict()
+            self._buffered = 0
+            for future in self._pending:
+                future.result()
+            self._pending = set()
+        finally:
+            self._executor.shutdown(wait=True)
+
+        self.parts.sort(key=lambda p: p["file"])
+        manifest = {
+            "created": datetime.now().isoformat(),
+            "format": self.fmt,
+            "compression": self.compression,
+            "columns": self.names,
+            "partition_field": self.partitionField,
+            "rows": sum(p["rows"] for p in self.parts),
+            "parts": self.parts,
+        }
+        with open(self.outputDir / "manifest.json", "w", encoding="utf8") as fd:
+            json.dump(manifest, fd, indent=2, cls=type(self.encoder))
+        return manifest
+
+    def abort(self):
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown(wait=True)
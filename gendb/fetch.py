@@ -0,0 +1,119 @@
+# Python Libaries
+import sys
+from datetime import date, datetime, time
+from decimal import Decimal
+
+### User Modules
+from .log import get_logger
+from .trace import estimate_bytes
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Memory budgeted fetch sizing
+# db.settings["fetch_budget"] = 8 * 1024 * 1024 makes every fetchmany pull about that many bytes
+# of rows instead of a fixed row count. The first batch size comes from cursor.description (the
+# declared size of each column), after each batch the row width is measured from the rows that
+# came back, so narrow rows get bigger batches and wide text/blob rows smaller ones:
+#
+# sizer = BatchSizer(8 * 1024 * 1024, cursor.description)
+# rows = cursor.fetchmany(sizer.size)
+# sizer.observe(rows)
+# sizer.stats()   # {"batches": 1, "rows": ..., "peak_bytes": ..., "avg_bytes": ..., ...}
+#
+# Without a budget the batch size stays fixed and the batches are still measured for stats().
+
+MIN_ROWS = 16
+MAX_ROWS = 100000
+# text and binary columns without a usable declared size (varchar(max), SQLite)
+UNKNOWN_SIZE = 256
+LARGE_SIZE = 64 * 1024
+
+_emptySizes = {
+    bool: sys.getsizeof(True),
+    int: sys.getsizeof(2**40),
+    float: sys.getsizeof(1.0),
+    Decimal: sys.getsizeof(Decimal("1.1")),
+    datetime: sys.getsizeof(datetime(2000, 1, 1)),
+    date: sys.getsizeof(date(2000, 1, 1)),
+    time: sys.getsizeof(time(0)),
+}
+
+
+def column_width(column):
+    # Estimated bytes of one value, column is one cursor.description entry
+    typeCode = column[1] if len(column) > 1 else None
+    if typeCode in _emptySizes:
+        return _emptySizes[typeCode]
+    # display_size or internal_size, 0 and very large values mean the size is unknown
+    declared = max((s for s in column[2:4] if isinstance(s, int)), default=0)
+    if declared <= 0 or declared > LARGE_SIZE:
+        declared = UNKNOWN_SIZE
+    if typeCode in (bytes, bytearray):
+        return sys.getsizeof(b"") + declared
+    return sys.getsizeof("") + declared
+
+
+def row_width(description):
+    # Estimated bytes of one raw row: the row object plus its values
+    description = description or []
+    return sys.getsizeof(tuple(range(len(description)))) + sum(column_width(c) for c in description)
+
+
+class BatchSizer:
+    def __init__(
+        self, budget, description=None, batchSize=1000, minRows=MIN_ROWS, maxRows=MAX_ROWS
+    ):
+        self.budget = budget
+        self.minRows = minRows
+        self.maxRows = maxRows
+        self.rowBytes = row_width(description)
+        self.size = batchSize
+        if budget:
+            self.size = self._rows_for(self.rowBytes)
+        self.batches = 0
+        self.rows = 0
+        self.totalBytes = 0
+        self.peakBytes = 0
+        self.smallest = None
+        self.largest = 0
+
+    def _rows_for(self, rowBytes):
+        return max(self.minRows, min(self.maxRows, int(self.budget // max(rowBytes, 1))))
+
+    def observe(self, rows):
+        # Records a fetched batch and sizes the next one, returns the batch's estimated bytes
+        count = len(rows)
+        if not count:
+            return 0
+        batchBytes = estimate_bytes(rows)
+        self.batches += 1
+        self.rows += count
+        self.totalBytes += batchBytes
+        self.peakBytes = max(self.peakBytes, batchBytes)
+        self.smallest = count if self.smallest is None else min(self.smallest, count)
+        self.largest = max(self.largest, count)
+
+        if self.budget:
+            observed = batchBytes / count
+            # wider rows shrink the next batch at once, narrower rows grow it gradually
+            if observed >= self.rowBytes:
+                self.rowBytes = observed
+            else:
+                self.rowBytes = (self.rowBytes + observed) / 2
+            self.size = min(self._rows_for(self.rowBytes), self.size * 2)
+        return batchBytes
+
+    def stats(self):
+        return {
+            "budget": self.budget,
+            "batches": self.batches,
+            "rows": self.rows,
+            "batch_size": self.size,
+            "min_batch_rows": self.smallest or 0,
+            "max_batch_rows": self.largest,
+            "row_bytes": int(self.totalBytes / self.rows) if self.rows else int(self.rowBytes),
+            "peak_bytes": self.peakBytes,
+            "avg_bytes": int(self.totalBytes / self.batches) if self.batches else 0,
+            "total_bytes": self.totalBytes,
+        }
@@ -0,0 +1,102 @@
+# Python Libaries
+from bisect import bisect_left, bisect_right
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### In memory indexes over a query result
+# Built from the result's columns once, then map a key (a value, or a tuple of values for
+# several fields) to row positions in the result.
+#
+# HashIndex   equality lookups in O(1)           index.lookup(30) / index.lookup(("vc30", 30))
+# SortedIndex range scans with bisect, O(log n)  index.range(20, 40)
+#
+# Both work with a list of dictionaries, RowList, ColumnarResult and NumpyResult. Rows with a
+# NULL in an indexed field are left out of SortedIndex (NULL is not ordered) but kept in HashIndex.
+
+
+def key_columns(result, fields):
+    # One list of values per field, None when a field is missing from the result
+    columns = []
+    for field in fields:
+        if isinstance(result, list) and not hasattr(result, "columns"):
+            if len(result) and field not in result[0]:
+                return None
+            columns.append([row.get(field) for row in result])
+        else:
+            column = result.column(field)
+            if column is None:
+                return None
+            # NumpyResult columns: tolist() gives Python values and None for masked NULLs
+            columns.append(column.tolist() if hasattr(column, "tolist") else column)
+    return columns
+
+
+def _keys(columns):
+    if len(columns) == 1:
+        return columns[0]
+    return list(zip(*columns))
+
+
+class HashIndex:
+    def __init__(self, fields, columns):
+        self.fields = tuple(fields)
+        self._positions = dict()
+        for pos, key in enumerate(_keys(columns)):
+            self._positions.setdefault(key, []).append(pos)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def lookup(self, key):
+        return self._positions.get(key, [])
+
+
+class SortedIndex:
+    def __init__(self, fields, columns):
+        self.fields = tuple(fields)
+        multi = len(columns) > 1
+        pairs = [
+            (key, pos)
+            for pos, key in enumerate(_keys(columns))
+            if not (None in key if multi else key is None)
+        ]
+        pairs.sort(key=lambda p: p[0])
+        self._keys = [p[0] for p in pairs]
+        self._positions = [p[1] for p in pairs]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def lookup(self, key):
+        return self._positions[bisect_left(self._keys, key) : bisect_right(self._keys, key)]
+
+    def range(self, low=None, high=None, includeLow=True, includeHigh=True):
+        # Positions with low <= key <= high in key order, None leaves that end open
+        start = 0
+        end = len(self._keys)
+        if low is not None:
+            start = (bisect_left if includeLow else bisect_right)(self._keys, low)
+        if high is not None:
+            end = (bisect_right if includeHigh else bisect_left)(self._keys, high)
+        return self._positions[start:end]
+
+
+index_types = {"hash": HashIndex, "sorted": SortedIndex}
+
+
+def build_index(result, fields, kind="hash"):
+    if isinstance(fields, str):
+        fields = [fields]
+    if kind not in index_types:
+        logger.error(f"Error! Unknown index type: {kind}")
+        return None
+    columns = key_columns(result, fields)
+    if columns is None:
+        logger.error(f"Error! Index fields not found in result: {fields}")
+        return None
+    logger.info(f"Building {kind} index on: {fields}")
+    return index_types[kind](fields, columns)
@@ -0,0 +1,278 @@
+# Python Libaries
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+### User Modules
+from .log import get_logger
+from .template import mask_sql
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Large IN / NOT IN lists
+# add_conditional(field, "in", values) puts one "?" per value into the statement, which
+# breaks parameter limits (2100 on SQL Server) and slows down parsing long before that.
+# A list is rewritten when the statement's parameters plus the list would pass dialect.maxParams,
+# or when it is longer than db.settings["in_list_threshold"] if that is set:
+#
+# temp table: dialects with a tempTable definition (SQL Server, SQLite, PostgreSQL)
+#   field IN (SELECT v FROM #gendb_in_0)
+#   the values are loaded with executemany on the query's connection right before it runs.
+#   IN and NOT IN keep their meaning, including NULLs in the list.
+#
+# chunks: every other dialect
+#   field IN (?,?,...)  with chunkSize placeholders, the statement is executed once per chunk
+#   (the last chunk padded by repeating a value) and the rows are concatenated. Only one
+#   list per query can be chunked, NOT IN is left inline, and an ORDER BY only holds
+#   within each chunk. Concatenated chunks are not one result for aggregates, DISTINCT,
+#   GROUP BY, TOP/LIMIT and the like, lists in those statements are left inline and
+#   paginate raises ValueError for a chunked list.
+#
+# Both are carried in the parameter list as marker objects, SQLServer._execute expands them.
+
+
+class TempTableList:
+    # Loads into a temp table, takes no "?" in the statement
+    def __init__(self, dialect, table, values, sqlType):
+        self.dialect = dialect
+        self.table = table
+        self.values = list(values)
+        self.sqlType = sqlType
+        self._loadedCursor = None
+
+    def __repr__(self):
+        return f"TempTableList({self.table}, {len(self.values)} values)"
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, TempTableList)
+            and other.table == self.table
+            and other.values == self.values
+        )
+
+    def __hash__(self):
+        return hash((self.table, tuple(self.values)))
+
+    def load(self, cursor, fastExecutemany=False):
+        # Once per cursor, paginate runs several statements on the same one
+        if self._loadedCursor is cursor:
+            return
+        tempTable = self.dialect.tempTable
+        cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+        cursor.execute(tempTable["create"].format(table=self.table, type=self.sqlType))
+        if fastExecutemany:
+            cursor.fast_executemany = True
+        try:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (v) VALUES (?)", [(v,) for v in self.values]
+            )
+        finally:
+            if fastExecutemany:
+                cursor.fast_executemany = False
+        self._loadedCursor = cursor
+        logger.info(f"Loaded {len(self.values)} IN list values into {self.table}")
+
+
+class InListChunks:
+    # Stands for chunkSize "?" in the statement, one chunk of values per execution
+    def __init__(self, values, chunkSize):
+        self.values = list(values)
+        self.chunkSize = chunkSize
+
+    def __repr__(self):
+        return f"InListChunks({len(self.values)} values, chunk size {self.chunkSize})"
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, InListChunks)
+            and other.chunkSize == self.chunkSize
+            and other.values == self.values
+        )
+
+    def __hash__(self):
+        return hash((self.chunkSize, tuple(self.values)))
+
+    def chunks(self):
+        for start in range(0, len(self.values), self.chunkSize):
+            chunk = self.values[start : start + self.chunkSize]
+            # repeating a value does not change what IN matches, the statement text stays the same
+            yield chunk + [chunk[-1]] * (self.chunkSize - len(chunk))
+
+
+# Statements whose rows do not simply add up over the chunks
+_chunkUnsafe = re.compile(
+    r"\b(?:DISTINCT|GROUP\s+BY|HAVING|TOP|LIMIT|OFFSET|FETCH|UNION|INTERSECT|EXCEPT|OVER)\b"
+    r"|\b(?:COUNT|SUM|AVG|MIN|MAX|STRING_AGG|GROUP_CONCAT|LISTAGG|ARRAY_AGG)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def chunk_safe(sql):
+    return _chunkUnsafe.search(mask_sql(sql)) is None
+
+
+def param_count(inVars):
+    # "?" placeholders the parameters take in the statement
+    count = 0
+    for value in inVars or ():
+        if isinstance(value, InListChunks):
+            count += value.chunkSize
+        elif not isinstance(value, TempTableList):
+            count += 1
+    return count
+
+
+def in_list_markers(inVars):
+    return any(isinstance(v, (TempTableList, InListChunks)) for v in inVars or ())
+
+
+def unique_values(values):
+    # Duplicates would make a row match two chunks, order is kept
+    seen = set()
+    unique = []
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            unique.append(value)
+    return unique
+
+
+def value_kind(values):
+    # Column type needed to hold every (non NULL) value, None when the types are mixed
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, (bool, int)):
+            kinds.add("int")
+        elif isinstance(value, float):
+            kinds.add("float")
+        elif isinstance(value, Decimal):
+            kinds.add("decimal")
+        elif isinstance(value, str):
+            kinds.add("text" if len(value) > 4000 else "str")
+        elif isinstance(value, datetime):
+            kinds.add("datetime")
+        elif isinstance(value, date):
+            kinds.add("date")
+        elif isinstance(value, (bytes, bytearray)):
+            kinds.add("bytes")
+        else:
+            return None
+    if kinds <= {"int", "float"} and "float" in kinds:
+        return "float"
+    if kinds <= {"str", "text"} and "text" in kinds:
+        return "text"
+    if len(kinds) == 1:
+        return kinds.pop()
+    if not kinds:
+        return "int"
+    return None
+
+
+def temp_table_type(dialect, values):
+    # SQL type of the temp table column, "" for untyped (SQLite), None when no type fits
+    types = dialect.tempTable.get("types")
+    if types is None:
+        return ""
+    kind = value_kind(values)
+    if kind == "text" and "text" not in types:
+        kind = "str"
+    return types.get(kind)
+
+
+def large_in_conditional(dialect, sql, field, inType, values, number, chunkSize, chunked):
+    # Returns (sql fragment, [marker]) or None when the list has to stay inline.
+    # sql: the statement so far, number: temp tables already used by this query,
+    # chunked: a list is already chunked
+    if dialect.tempTable is not None:
+        sqlType = temp_table_type(dialect, values)
+        if sqlType is not None:
+            table = dialect.tempTable["name"].format(name=f"gendb_in_{number}")
+            marker = TempTableList(dialect, table, values, sqlType)
+            return f"{field} {inType} (SELECT v FROM {table})", [marker]
+        logger.warning(f"IN list on {field} mixes value types, no temp table type fits")
+
+    if inType.lower() == "not in":
+        logger.warning(
+            f"NOT IN on {field} with {len(values)} values cannot be chunked, sending it inline"
+        )
+        return None
+    if chunked:
+        logger.warning(f"Only one IN list per query is chunked, sending {field} inline")
+        return None
+    if not chunk_safe(sql):
+        logger.warning(
+            f"IN list on {field} is in a statement with aggregates, DISTINCT, GROUP BY or a row"
+            " limit, chunks would change the result, sending it inline"
+        )
+        return None
+
+    values = unique_values(values)
+    qString = "(" + ",".join(["?"] * chunkSize) + ")"
+    return f"{field} {inType} {qString}", [InListChunks(values, chunkSize)]
+
+
+class ChunkedCursor:
+    # Runs one statement per InListChunks chunk and reads the results back to back,
+    # exposes the cursor methods SQLServer reads results with
+    def __init__(self, cursor, sql, varSets, execute):
+        self._cursor = cursor
+        self._sql = sql
+        self._varSets = iter(varSets)
+        self._execute = execute
+        self._done = False
+        self._next_statement()
+        self.description = cursor.description
+
+    def _next_statement(self):
+        inVars = next(self._varSets, None)
+        if inVars is None:
+            self._done = True
+            return False
+        self._execute(self._cursor, self._sql, inVars)
+        return True
+
+    def fetchmany(self, size=1):
+        rows = []
+        while not self._done and len(rows) < size:
+            batch = self._cursor.fetchmany(size - len(rows))
+            if batch:
+                rows.extend(batch)
+            else:
+                self._next_statement()
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        rows = []
+        while not self._done:
+            rows.extend(self._cursor.fetchall())
+            self._next_statement()
+        return rows
+
+    def close(self):
+        self._cursor.close()
+
+
+def expand_in_lists(cursor, inVars, fastExecutemany=False):
+    # Loads temp tables on the cursor and returns the parameter lists to execute:
+    # one list, or one per chunk when an InListChunks marker is present
+    plainVars = []
+    chunked = None
+    for value in inVars:
+        if isinstance(value, TempTableList):
+            value.load(cursor, fastExecutemany)
+        elif isinstance(value, InListChunks):
+            chunked = (len(plainVars), value)
+        else:
+            plainVars.append(value)
+    if chunked is None:
+        return [plainVars]
+
+    pos, marker = chunked
+    return (plainVars[:pos] + chunk + plainVars[pos:] for chunk in marker.chunks())
@@ -14,9 +14,12 @@ from pathlib import Path
 # logger.critical("this is a critical message")  # integer value: 50
 ###
 
+
 ### Grab Logging details from environment variables if they exist, if not use defaults
+# Nothing is printed, created or opened on import. Records go to the console, and also to a file
+# only when LOG_FOLDER is set (never inside the installed package): the folder and file are
+# created on the first record written. Every logger shares one console and one file handler.
 def check_environment_vars(envVar, defaultVal):
-    print(defaultVal)
     if os.environ.get(envVar):
         return os.environ.get(envVar)
     return defaultVal
@@ -27,31 +30,56 @@ LOG_FORMAT = logging.Formatter(
     check_environment_vars("LOG_FORMAT", "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 )
 LOG_FILE = check_environment_vars("LOG_FILE", "genDB.log")
-LOG_FOLDER = check_environment_vars("LOG_FOLDER", Path(__file__).resolve().parent / "logs")
-if not LOG_FOLDER.is_dir():
-    LOG_FOLDER.mkdir(parents=True, exist_ok=True)
+LOG_FOLDER = check_environment_vars("LOG_FOLDER", None)
+if LOG_FOLDER is not None:
+    LOG_FOLDER = Path(LOG_FOLDER)
+
+
+class LazyFileHandler(TimedRotatingFileHandler):
+    # delay=True keeps the file closed until the first record, the folder is made at that point
+    def __init__(self, filename, **kwargs):
+        kwargs.setdefault("delay", True)
+        super().__init__(filename, **kwargs)
+
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+
+_handlers = dict()
 
 
 def get_console_handler():
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(LOG_FORMAT)
-    return console_handler
+    if "console" not in _handlers:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(LOG_FORMAT)
+        _handlers["console"] = console_handler
+    return _handlers["console"]
 
 
 def get_file_handler():
-    outputFile = Path(LOG_FOLDER, LOG_FILE)
-    print(f"Logging file location: {outputFile}")
-    file_handler = TimedRotatingFileHandler(outputFile, when="midnight")
-    file_handler.setFormatter(LOG_FORMAT)
-    return file_handler
+    # None when file logging is off (LOG_FOLDER not set)
+    if LOG_FOLDER is None:
+        return None
+    if "file" not in _handlers:
+        outputFile = Path(LOG_FOLDER, LOG_FILE)
+        file_handler = LazyFileHandler(outputFile, when="midnight")
+        file_handler.setFormatter(LOG_FORMAT)
+        _handlers["file"] = file_handler
+    return _handlers["file"]
 
 
 def get_logger(logger_name):
     logger = logging.getLogger(logger_name)
-    print(f"Setting logging level to: {LOG_LEVEL}")
+    # calling get_logger again for the same name does not add more handlers
+    if getattr(logger, "_gendbConfigured", False):
+        return logger
     logger.setLevel(LOG_LEVEL)  # better to have too much log than not enough
     logger.addHandler(get_console_handler())
-    logger.addHandler(get_file_handler())
+    file_handler = get_file_handler()
+    if file_handler is not None:
+        logger.addHandler(file_handler)
     # with this pattern, it's rarely necessary to propagate the error up to parent
     logger.propagate = False
-    return logger
\ No newline at end of file
+    logger._gendbConfigured = True
+    return logger
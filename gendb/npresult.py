@@ -0,0 +1,269 @@
+# Python Libaries
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### NumPy typed result (optional dependency: pip install gendb[numpy])
+# One typed array per column, filled straight from fetchmany batches, plus a boolean NULL
+# mask per column. Supports the same access as ColumnarResult (len, result[i], iteration,
+# column, select, rename) and vectorized helpers:
+#
+# res.column("testInt")                       # ndarray, or a masked array when it has NULLs
+# res.filter("testInt", ">", 20)              # new NumpyResult with the matching rows
+# res.sort(["testVarChar", "testInt"], descending=True)
+# res.aggregate("testFloat", "mean")          # NULLs are ignored
+
+
+def numpy_dtype(column):
+    # column is one cursor.description entry, column[1] is the Python type reported by pyodbc
+    typeCode = column[1]
+    if typeCode is bool:
+        return np.dtype(bool)
+    if typeCode is int:
+        return np.dtype(np.int64)
+    if typeCode in (float, Decimal):
+        return np.dtype(np.float64)
+    if typeCode is datetime:
+        return np.dtype("datetime64[us]")
+    if typeCode is date:
+        return np.dtype("datetime64[D]")
+    return np.dtype(object)
+
+
+def _fill_value(dtype):
+    # Placeholder stored under a NULL, the mask says the value is missing
+    if dtype.kind == "M":
+        return np.datetime64("NaT")
+    if dtype.kind == "f":
+        return np.nan
+    if dtype.kind == "O":
+        return None
+    return dtype.type(0)
+
+
+class NumpyResult:
+    def __init__(self, columns, values, masks):
+        self.columns = list(columns)
+        self._index = {name: pos for pos, name in enumerate(self.columns)}
+        self._values = values  # list of ndarrays, one per column
+        self._masks = masks  # list of bool ndarrays, True where the value is NULL
+        self._length = len(values[0]) if values else 0
+
+    @classmethod
+    def from_description(cls, description, capacity=1024):
+        columns = [c[0] for c in description]
+        dtypes = [numpy_dtype(c) for c in description]
+        result = cls(
+            columns,
+            [np.empty(capacity, dtype=d) for d in dtypes],
+            [np.zeros(capacity, dtype=bool) for _ in dtypes],
+        )
+        result._length = 0
+        return result
+
+    ###### Loading ######
+    def append_rows(self, rows):
+        # Copies a fetchmany batch into the preallocated arrays, doubling them when full
+        count = len(rows)
+        if not count:
+            return
+        length = self._length
+        needed = length + count
+        capacity = len(self._values[0]) if self._values else 0
+        if needed > capacity:
+            newCapacity = max(needed, capacity * 2)
+            self._values = [self._grow(a, newCapacity) for a in self._values]
+            self._masks = [self._grow(m, newCapacity) for m in self._masks]
+
+        for pos, (values, mask) in enumerate(zip(self._values, self._masks)):
+            column = [row[pos] for row in rows]
+            nulls = [v is None for v in column]
+            if any(nulls):
+                fill = _fill_value(values.dtype)
+                column = [fill if n else v for v, n in zip(column, nulls)]
+                mask[length:needed] = nulls
+            else:
+                mask[length:needed] = False
+            if values.dtype.kind == "O":
+                values[length:needed] = np.array(column + [None], dtype=object)[:-1]
+            else:
+                values[length:needed] = np.asarray(column, dtype=values.dtype)
+        self._length = needed
+
+    @staticmethod
+    def _grow(array, capacity):
+        grown = np.empty(capacity, dtype=array.dtype)
+        grown[: len(array)] = array
+        return grown
+
+    def finish(self):
+        # Trims the spare capacity left over from loading
+        self._values = [a[: self._length].copy() for a in self._values]
+        self._masks = [m[: self._length].copy() for m in self._masks]
+        return self
+
+    ###### Row Access ######
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self._row(i) for i in range(*pos.indices(len(self)))]
+        if pos < 0:
+            pos += len(self)
+        if pos < 0 or pos >= len(self):
+            raise IndexError("NumpyResult index out of range")
+        return self._row(pos)
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self._row(pos)
+
+    def __repr__(self):
+        return f"NumpyResult(columns={self.columns}, rows={len(self)})"
+
+    def _row(self, pos):
+        row = dict()
+        for name, values, mask in zip(self.columns, self._values, self._masks):
+            if mask[pos]:
+                row[name] = None
+            else:
+                value = values[pos]
+                row[name] = value.item() if hasattr(value, "item") else value
+        return row
+
+    ###### Columns ######
+    def column(self, name):
+        pos = self._index.get(name)
+        if pos is None:
+            return None
+        values = self._values[pos][: len(self)]
+        mask = self._masks[pos][: len(self)]
+        if mask.any():
+            return np.ma.MaskedArray(values, mask=mask)
+        return values
+
+    def null_mask(self, name):
+        pos = self._index.get(name)
+        if pos is None:
+            return None
+        return self._masks[pos][: len(self)]
+
+    def select(self, fieldList):
+        fields = [f for f in fieldList if f in self._index]
+        return NumpyResult(
+            fields,
+            [self._values[self._index[f]][: len(self)] for f in fields],
+            [self._masks[self._index[f]][: len(self)] for f in fields],
+        )
+
+    def rename(self, keyDict):
+        # keyDict = {"Old_Name": "New_Name"}
+        return NumpyResult(
+            [keyDict.get(c, c) for c in self.columns],
+            [v[: len(self)] for v in self._values],
+            [m[: len(self)] for m in self._masks],
+        )
+
+    ###### Vectorized Helpers ######
+    def mask(self, field, op, value):
+        # Boolean array of rows matching "field op value", NULLs never match
+        pos = self._index[field]
+        values = self._values[pos][: len(self)]
+        nulls = self._masks[pos][: len(self)]
+        ops = {
+            "=": np.equal,
+            "==": np.equal,
+            "!=": np.not_equal,
+            "<>": np.not_equal,
+            ">": np.greater,
+            ">=": np.greater_equal,
+            "<": np.less,
+            "<=": np.less_equal,
+        }
+        if op not in ops and op not in ("in", "not in"):
+            raise ValueError(f"NumpyResult: unsupported operator {op}")
+
+        # Compare only the non NULL values, object columns hold None under the mask
+        present = np.flatnonzero(~nulls)
+        presentValues = values[present]
+        if op in ("in", "not in"):
+            if presentValues.dtype.kind == "O":
+                lookup = set(value)
+                hits = np.fromiter((v in lookup for v in presentValues), bool, len(present))
+            else:
+                hits = np.isin(presentValues, list(value))
+            if op == "not in":
+                hits = ~hits
+        else:
+            hits = np.asarray(ops[op](presentValues, value), dtype=bool)
+
+        matched = np.zeros(len(values), dtype=bool)
+        matched[present] = hits
+        return matched
+
+    def take(self, indexes):
+        return NumpyResult(
+            self.columns,
+            [v[: len(self)][indexes] for v in self._values],
+            [m[: len(self)][indexes] for m in self._masks],
+        )
+
+    def filter(self, fieldOrMask, op=None, value=None):
+        # filter(boolArray) or filter("field", ">", 10)
+        if isinstance(fieldOrMask, str):
+            fieldOrMask = self.mask(fieldOrMask, op, value)
+        return self.take(np.asarray(fieldOrMask, dtype=bool))
+
+    def sort(self, fields, descending=False):
+        # Stable multi-column sort, NULLs last
+        if isinstance(fields, str):
+            fields = [fields]
+        keys = []
+        for field in reversed(fields):
+            pos = self._index[field]
+            values = self._values[pos][: len(self)]
+            nulls = self._masks[pos][: len(self)]
+            ranks = np.zeros(len(values), dtype=np.int64)
+            present = np.flatnonzero(~nulls)
+            if values.dtype.kind == "O":
+                order = sorted(present, key=lambda i: values[i])
+                presentRanks = np.empty(len(order), dtype=np.int64)
+                for rank, i in enumerate(order):
+                    # equal values share a rank so the sort stays stable
+                    if rank and values[i] == values[order[rank - 1]]:
+                        presentRanks[rank] = presentRanks[rank - 1]
+                    else:
+                        presentRanks[rank] = rank
+                ranks[order] = presentRanks
+            elif len(present):
+                _, ranks[present] = np.unique(values[present], return_inverse=True)
+            if descending:
+                ranks = ranks.max(initial=0) - ranks
+            # lexsort uses the last key as the primary one
+            keys.append(ranks)
+            keys.append(nulls)
+        if not keys:
+            return self.take(np.arange(len(self)))
+        return self.take(np.lexsort(keys))
+
+    def aggregate(self, field, func):
+        # func: "count", "sum", "mean", "min", "max" or "std", NULLs are ignored
+        pos = self._index[field]
+        values = self._values[pos][: len(self)][~self._masks[pos][: len(self)]]
+        if func == "count":
+            return int(len(values))
+        if not len(values):
+            return None
+        funcs = {"sum": np.sum, "mean": np.mean, "min": np.min, "max": np.max, "std": np.std}
+        if func not in funcs:
+            raise ValueError(f"NumpyResult: unsupported aggregate {func}")
+        result = funcs[func](values)
+        return result.item() if hasattr(result, "item") else result
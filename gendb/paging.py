@@ -0,0 +1,120 @@
+# Python Libaries
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+### User Modules
+from .log import get_logger
+from .query import valid_field
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Keyset (seek) pagination
+# Each page continues after the last row of the previous page:
+#   ... AND ((a > ?) OR (a = ? AND b > ?)) ORDER BY a, b LIMIT ?
+# so page N costs the same as page 1. The order by fields must identify a row uniquely
+# (end with a key column) and should not contain NULLs.
+
+
+class Page(list):
+    # A list of row dictionaries, token resumes pagination after the last row (None on the last page)
+    def __init__(self, rows, token=None, number=None):
+        super().__init__(rows)
+        self.token = token
+        self.number = number
+
+
+def parse_order_by(orderBy):
+    # "field", "field DESC" or a list of those -> [(field, descending)] or None when not allowed
+    if isinstance(orderBy, str):
+        orderBy = [f.strip() for f in orderBy.split(",")]
+    parsed = []
+    for item in orderBy:
+        parts = item.split()
+        if len(parts) == 1 or (len(parts) == 2 and parts[1].lower() in ("asc", "desc")):
+            if not valid_field(parts[0]):
+                return None
+            parsed.append((parts[0], len(parts) == 2 and parts[1].lower() == "desc"))
+        else:
+            logger.error(f"Error! Incompatible Order By: {item}")
+            return None
+    return parsed
+
+
+def order_clause(orderFields):
+    return " ORDER BY " + ", ".join(
+        f"{field} DESC" if desc else f"{field} ASC" for field, desc in orderFields
+    )
+
+
+def keyset_predicate(orderFields, lastValues):
+    # (a > ?) OR (a = ? AND b > ?) OR ... with < for descending fields
+    clauses = []
+    inVars = []
+    for pos, (field, desc) in enumerate(orderFields):
+        parts = []
+        for prevField, _ in orderFields[:pos]:
+            parts.append(f"{prevField} = ?")
+        parts.append(f"{field} {'<' if desc else '>'} ?")
+        inVars.extend(lastValues[: pos + 1])
+        clauses.append("(" + " AND ".join(parts) + ")")
+    return "(" + " OR ".join(clauses) + ")", inVars
+
+
+### Resumable tokens, values are tagged so dates and binary keys survive the round trip
+# (also used for the watermarks saved by gendb.refresh)
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"dec": str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {"b": bytes(value).hex()}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        if "dec" in value:
+            return Decimal(value["dec"])
+        if "b" in value:
+            return bytes.fromhex(value["b"])
+    return value
+
+
+def encode_token(orderFields, lastValues, number=0):
+    # number: the page the token was handed out with, resumed pages are numbered after it
+    payload = {
+        "o": [[f, d] for f, d in orderFields],
+        "v": [encode_value(v) for v in lastValues],
+        "n": number,
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf8")).decode("ascii")
+
+
+def decode_token(token, orderFields):
+    # (last values, page number) or None when the token is invalid or for another order by
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf8"))
+        lastValues = [decode_value(v) for v in payload["v"]]
+        number = int(payload.get("n", 0))
+    except Exception as e:
+        logger.error(f"Error! Invalid page token: {e}")
+        return None
+    if [tuple(o) for o in payload.get("o", [])] != list(orderFields):
+        logger.error(f"Error! Page token was created for a different order by: {payload.get('o')}")
+        return None
+    if len(lastValues) != len(orderFields):
+        logger.error(
+            f"Error! Page token has {len(lastValues)} values for {len(orderFields)} fields"
+        )
+        return None
+    return lastValues, number
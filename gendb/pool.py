@@ -0,0 +1,256 @@
+# Python Libaries
+import threading
+import time
+from collections import deque
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Example Usage
+# pool = get_pool(connectionString, minSize=1, maxSize=5)  # opens minSize connections
+# conn = pool.acquire()
+# ... use the connection ...
+# pool.release(conn)
+# pool.stats()  # {"hits": ..., "misses": ..., "waits": ..., "wait_time": ...}
+###
+
+pool_defaults = {
+    "min_size": 0,
+    "max_size": 5,
+    "idle_timeout": 300,  # seconds an unused connection can sit in the pool
+    "acquire_timeout": 30,  # seconds to wait for a free connection when the pool is full
+    "health_check": "SELECT 1",  # None disables the checkout health check
+    "check_after": 30,  # seconds idle before a connection is health checked on checkout
+}
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connectionString,
+        minSize=pool_defaults["min_size"],
+        maxSize=pool_defaults["max_size"],
+        idleTimeout=pool_defaults["idle_timeout"],
+        acquireTimeout=pool_defaults["acquire_timeout"],
+        healthCheck=pool_defaults["health_check"],
+        checkAfter=pool_defaults["check_after"],
+    ):
+        self.connectionString = connectionString
+        self.minSize = minSize
+        self.maxSize = max(maxSize, 1)
+        self.idleTimeout = idleTimeout
+        self.acquireTimeout = acquireTimeout
+        self.healthCheck = healthCheck
+        self.checkAfter = checkAfter
+
+        # idle holds (connection, last returned time), newest on the right
+        self._idle = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "created": 0,
+            "closed": 0,
+            "evicted": 0,
+            "failed_checks": 0,
+        }
+        if self.minSize:
+            self.fill()
+
+    ###### Methods ######
+    def acquire(self):
+        waited = None
+        with self._lock:
+            evicted = self._evict_idle()
+        # closing can take a network round trip, other threads keep using the pool meanwhile
+        for conn in evicted:
+            self._close(conn)
+
+        with self._lock:
+            while True:
+                if self._idle:
+                    conn, returned = self._idle.pop()
+                    self._stats["hits"] += 1
+                    break
+                if self._size < self.maxSize:
+                    # Reserve the slot now, connect outside of the lock
+                    self._size += 1
+                    self._stats["misses"] += 1
+                    conn = None
+                    break
+                if waited is None:
+                    waited = time.monotonic()
+                    self._stats["waits"] += 1
+                remaining = self.acquireTimeout - (time.monotonic() - waited)
+                if remaining <= 0:
+                    self._stats["wait_time"] += time.monotonic() - waited
+                    raise TimeoutError(
+                        f"Connection Pool: no connection available after {self.acquireTimeout}s"
+                    )
+                self._available.wait(remaining)
+
+            if waited is not None:
+                self._stats["wait_time"] += time.monotonic() - waited
+
+        if conn is None:
+            return self._create()
+
+        # recently returned connections skip the health check round trip
+        if time.monotonic() - returned >= self.checkAfter and not self._check(conn):
+            # replaced within the slot this call holds, so no waiter can take it meanwhile
+            self._close(conn)
+            with self._lock:
+                self._stats["closed"] += 1
+            return self._create()
+
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                # Never hand out a connection with an open transaction
+                conn.rollback()
+            except Exception as e:
+                logger.error(f"Connection Pool: rollback on release failed: {e}")
+                discard = True
+
+        if discard:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._stats["closed"] += len(idle)
+            self._available.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def fill(self):
+        # Open connections until the pool holds at least minSize
+        while True:
+            with self._lock:
+                if self._size >= self.minSize:
+                    return
+                self._size += 1
+            conn = self._create()
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+        return stats
+
+    ###### Helpers ######
+    def _create(self):
+        # Connects for a slot already counted in _size, the slot is freed when connecting fails
+        try:
+            # imported on first use so importing gendb does not load the ODBC driver manager
+            import pyodbc
+
+            conn = pyodbc.connect(r"" + self.connectionString)
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._available.notify()
+            raise
+        with self._lock:
+            self._stats["created"] += 1
+        return conn
+
+    def _check(self, conn):
+        if not self.healthCheck:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.healthCheck)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logger.info(f"Connection Pool: health check failed, replacing connection: {e}")
+            with self._lock:
+                self._stats["failed_checks"] += 1
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._size -= 1
+            self._stats["closed"] += 1
+            self._available.notify()
+        self._close(conn)
+
+    def _evict_idle(self):
+        # Called with the lock held, oldest connections are on the left. Returns the evicted
+        # connections for the caller to close after releasing the lock
+        evicted = []
+        if self.idleTimeout is None:
+            return evicted
+        now = time.monotonic()
+        while len(self._idle) and self._size > self.minSize:
+            conn, returned = self._idle[0]
+            if now - returned < self.idleTimeout:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self._stats["evicted"] += 1
+            evicted.append(conn)
+        return evicted
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.error(f"Connection Pool: error closing connection: {e}")
+
+
+### Process wide registry, one pool per connection string
+_pools = dict()
+_poolsLock = threading.Lock()
+
+
+def get_pool(connectionString, **kwargs):
+    with _poolsLock:
+        pool = _pools.get(connectionString)
+    if pool is not None:
+        return pool
+
+    # opening minSize connections can be slow, other environments' pools stay reachable meanwhile
+    pool = ConnectionPool(connectionString, **kwargs)
+    with _poolsLock:
+        registered = _pools.setdefault(connectionString, pool)
+    if registered is not pool:
+        # another thread registered a pool for this connection string first
+        pool.close()
+    return registered
+
+
+def pool_stats():
+    with _poolsLock:
+        pools = list(_pools.values())
+    return [p.stats() for p in pools]
+
+
+def close_pools():
+    with _poolsLock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for p in pools:
+        p.close()
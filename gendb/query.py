@@ -0,0 +1,335 @@
+# Python Libaries
+import re
+from functools import lru_cache
+
+### User Modules
+from .log import get_logger
+from .dialect import Dialect, resolve_dialect
+from .template import mask_sql
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+chkConditional = ["=", ">", "<", ">=", "<=", "<>", "!=", "in", "not in", "like", "not like"]
+
+
+# checkNumeric and convertString are kept for callers that pass a driver string,
+# conditionals are built from the Dialect resolved once per SQLServer instance
+def checkNumeric(inDriver, field):
+    return resolve_dialect(inDriver).numeric_check(field)
+
+
+def convertString(inDriver, field, value):
+    if isinstance(value, int):
+        return resolve_dialect(inDriver).cast(field, "int")
+    if isinstance(value, float):
+        return resolve_dialect(inDriver).cast(field, "float")
+    return field
+
+
+def as_dialect(dialect):
+    # Accepts a Dialect or a driver string
+    if isinstance(dialect, Dialect):
+        return dialect
+    return resolve_dialect(dialect)
+
+
+def valid_conditional(inType):
+    if not isinstance(inType, str) or inType.lower() not in chkConditional:
+        logger.error(
+            f"Error! Incompatible Conditional: {inType}. Allowed options: {chkConditional}"
+        )
+        return False
+    return True
+
+
+def valid_field(field):
+    if not isinstance(field, str) or (len(field) > 128 or re.search(r"\W", field) is not None):
+        logger.error(
+            f"Error! Incompatible Field: {field}. Must only contain alphanumeric and underscore"
+        )
+        return False
+    return True
+
+
+def valid_table(table):
+    # Allows dotted names with optional brackets: [master].[dbo].[testTable]
+    if not isinstance(table, str) or len(table) > 386:
+        logger.error(f"Error! Incompatible Table: {table}")
+        return False
+    for part in table.split("."):
+        if re.fullmatch(r"\[?\w+\]?", part) is None:
+            logger.error(
+                f"Error! Incompatible Table: {table}. Must only contain alphanumeric and underscore"
+            )
+            return False
+    return True
+
+
+def value_shape(inType, value):
+    # The parts of a value that change the SQL text: its kind and, for lists, the length
+    if value is None:
+        return ("null", 0)
+    if isinstance(value, list) and inType.lower() in ["in", "not in"]:
+        return ("list", len(value))
+    if isinstance(value, int):
+        return ("int", 1)
+    if isinstance(value, float):
+        return ("float", 1)
+    return ("value", 1)
+
+
+def shape_values(shape, value):
+    kind = shape[0]
+    if kind == "null":
+        return []
+    if kind == "list":
+        return list(value)
+    return [value]
+
+
+@lru_cache(maxsize=1024)
+def render_conditional(dialect, field, inType, shape):
+    kind, count = shape
+    # Check if we are search for NULL or excluding NULL values
+    if kind == "null":
+        if inType == "=":
+            return f"{field} is null"
+        if inType in ["!=", "<>"]:
+            return f"{field} is not null"
+        logger.error(f"Error! Incompatible Conditional for a null value: {inType}")
+        return None
+
+    # Check if value is in a list
+    if kind == "list":
+        qString = "(" + ",".join(["?"] * count) + ")"
+        return f"{field} {inType} {qString}"
+
+    # Check if value is numeric
+    if kind in ("int", "float"):
+        return f"{dialect.numeric_field(field, kind)} {inType} ?"
+
+    # If value is not in a list, not numeric, and not null, search without any data type checks
+    return f"{field} {inType} ?"
+
+
+def build_conditional(dialect, field, inType, value):
+    # Returns (sql fragment, parameter values) or None if the conditional is not allowed
+    if not valid_conditional(inType) or not valid_field(field):
+        return None
+
+    shape = value_shape(inType, value)
+    addString = render_conditional(as_dialect(dialect), field, inType, shape)
+    if addString is None:
+        return None
+    return addString, shape_values(shape, value)
+
+
+### Projection pushdown
+# Only the projected columns are selected by the database:
+#   SELECT * FROM t WHERE ...            -> SELECT a, b AS c FROM t WHERE ...
+#   anything else                        -> SELECT a, b AS c FROM (...) AS gendb_projection
+# A top level ORDER BY (and the paging after it) stays outside the derived table.
+def projection_list(fields, renames=None):
+    # [(field, alias)] with alias None when the field keeps its name, None when not allowed
+    renames = renames or dict()
+    if isinstance(fields, str):
+        fields = [fields]
+    projection = []
+    for field in fields:
+        alias = renames.get(field)
+        if not valid_field(field) or (alias is not None and not valid_field(alias)):
+            return None
+        projection.append((field, alias))
+    return projection
+
+
+def projection_names(projection):
+    return [alias or field for field, alias in projection]
+
+
+def top_level_order_by(sql):
+    # Position of the last ORDER BY outside parentheses, quotes, brackets and comments, None when
+    # there is none
+    masked = mask_sql(sql)
+    depths = []
+    depth = 0
+    for char in masked:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        depths.append(depth)
+    found = None
+    for match in _orderBy.finditer(masked):
+        if depths[match.start()] == 0:
+            found = match.start()
+    return found
+
+
+_orderBy = re.compile(r"\bORDER\s+BY\b", re.IGNORECASE)
+_selectStar = re.compile(r"^\s*SELECT\s+\*\s+FROM\s", re.IGNORECASE)
+_selectTop = re.compile(r"^\s*SELECT\s+(?:ALL\s+|DISTINCT\s+)?TOP\b", re.IGNORECASE)
+_rowLimit = re.compile(r"\b(?:OFFSET|FETCH|LIMIT)\b", re.IGNORECASE)
+
+
+def split_order_by(sql):
+    # (query, order tail) with the top level ORDER BY moved into the tail. The ORDER BY stays in
+    # the query (tail "") when it decides which rows TOP, OFFSET/FETCH or LIMIT return
+    orderPos = top_level_order_by(sql)
+    if orderPos is None:
+        return sql, ""
+    masked = mask_sql(sql)
+    if _selectTop.match(masked) or _rowLimit.search(masked, orderPos):
+        return sql, ""
+    return sql[:orderPos], sql[orderPos:]
+
+
+def project_sql(sql, projection):
+    if not projection:
+        return sql
+    columns = ", ".join(f"{field} AS {alias}" if alias else field for field, alias in projection)
+    match = _selectStar.match(sql)
+    if match is not None:
+        star = sql.index("*", 0, match.end())
+        return f"{sql[:star]}{columns}{sql[star + 1:]}"
+
+    # the line break ends a trailing "--" comment before the closing parenthesis
+    sql, orderStr = split_order_by(sql)
+    if orderStr:
+        orderStr = " " + orderStr
+    return f"SELECT {columns} FROM ({sql}\n) AS gendb_projection{orderStr}"
+
+
+def describe_sql(sql):
+    # Same columns as sql but no rows, a plain top level ORDER BY is dropped for the derived table
+    sql, _ = split_order_by(sql)
+    return f"SELECT * FROM ({sql}\n) AS gendb_describe WHERE 1 = 0"
+
+
+### Bulk write statements
+def insert_statement(table, fields):
+    if not valid_table(table) or not all(valid_field(f) for f in fields):
+        return None
+    return "INSERT INTO {} ({}) VALUES ({})".format(
+        table, ", ".join(fields), ",".join(["?"] * len(fields))
+    )
+
+
+def upsert_statement(dialect, table, fields, keyFields):
+    # Insert rows, updating the non key fields when a row with the same key already exists
+    if not valid_table(table) or not all(valid_field(f) for f in fields):
+        return None
+    if not keyFields or not all(k in fields for k in keyFields):
+        logger.error(f"Error! Upsert key fields {keyFields} must be part of the fields {fields}")
+        return None
+
+    updateFields = [f for f in fields if f not in keyFields]
+    fieldStr = ", ".join(fields)
+    qString = ",".join(["?"] * len(fields))
+
+    dialect = as_dialect(dialect)
+    if dialect.upsert == "merge":
+        onStr = " AND ".join(f"t.{k} = s.{k}" for k in keyFields)
+        sql = f"MERGE INTO {table} AS t USING (VALUES ({qString})) AS s ({fieldStr}) ON {onStr}"
+        if updateFields:
+            setStr = ", ".join(f"t.{f} = s.{f}" for f in updateFields)
+            sql += f" WHEN MATCHED THEN UPDATE SET {setStr}"
+        sourceStr = ", ".join(f"s.{f}" for f in fields)
+        return sql + f" WHEN NOT MATCHED THEN INSERT ({fieldStr}) VALUES ({sourceStr});"
+
+    if dialect.upsert == "on_conflict":
+        sql = f"INSERT INTO {table} ({fieldStr}) VALUES ({qString}) ON CONFLICT ({', '.join(keyFields)})"
+        if updateFields:
+            setStr = ", ".join(f"{f} = excluded.{f}" for f in updateFields)
+            return sql + f" DO UPDATE SET {setStr}"
+        return sql + " DO NOTHING"
+
+    logger.error(f"Error! Upsert is not supported for dialect: {dialect.name}")
+    return None
+
+
+### Reusable query builder
+# Collects conditional fragments once, renders the statement once per shape and can be
+# bound to new values repeatedly. Executing the same rendered SQL on one cursor lets
+# the driver reuse its prepared statement.
+#
+# qb = QueryBuilder("SELECT * FROM testTable WHERE 1 = 1", dialect)
+# qb.add_conditional("testInt", "!=", 10)
+# qb.add_conditional("testIntNull", "<", 4)
+# qb.sql   -> "SELECT * FROM testTable WHERE 1 = 1 AND ... != ? AND ... < ?"
+# qb.vars  -> [10, 4]
+# qb.bind([20, 5]) -> (same sql string, [20, 5])
+class QueryBuilder:
+    def __init__(self, sql, dialect, inVars=None):
+        # dialect can be a Dialect or a driver string
+        self.baseSql = sql
+        self.dialect = as_dialect(dialect)
+        if inVars and not isinstance(inVars, list):
+            inVars = [inVars]
+        self.baseVars = list(inVars) if inVars else []
+        self._conditions = list()  # (field, inType)
+        self._values = list()
+        self._rendered = None  # (shapes, sql)
+
+    ###### Properties ######
+    @property
+    def sql(self):
+        return self._render(self._shapes(self._values))
+
+    @property
+    def vars(self):
+        return self._flatten(self._shapes(self._values), self._values)
+
+    ###### Methods ######
+    def add_conditional(self, field, inType, value):
+        if not valid_conditional(inType) or not valid_field(field):
+            return
+        if render_conditional(self.dialect, field, inType, value_shape(inType, value)) is None:
+            return
+        self._conditions.append((field, inType))
+        self._values.append(value)
+        self._rendered = None
+
+    def add_conditional_dict(self, conditionDict):
+        # format: searchParameter = {field: (conditional,value)}
+        if conditionDict and isinstance(conditionDict, dict):
+            for key, value in conditionDict.items():
+                conditional, data = value
+                self.add_conditional(key, conditional, data)
+
+    def bind(self, values):
+        # values holds one entry per conditional, in the order they were added
+        if len(values) != len(self._conditions):
+            raise ValueError(
+                f"QueryBuilder: expected {len(self._conditions)} values, got {len(values)}"
+            )
+        shapes = self._shapes(values)
+        return self._render(shapes), self._flatten(shapes, values)
+
+    ###### Helpers ######
+    def _shapes(self, values):
+        return tuple(
+            value_shape(inType, value) for (_, inType), value in zip(self._conditions, values)
+        )
+
+    def _flatten(self, shapes, values):
+        inVars = list(self.baseVars)
+        for shape, value in zip(shapes, values):
+            inVars.extend(shape_values(shape, value))
+        return inVars
+
+    def _render(self, shapes):
+        if self._rendered is not None and self._rendered[0] == shapes:
+            return self._rendered[1]
+
+        parts = [self.baseSql]
+        for (field, inType), shape in zip(self._conditions, shapes):
+            addString = render_conditional(self.dialect, field, inType, shape)
+            if addString is None:
+                raise ValueError(
+                    f"QueryBuilder: value not allowed for conditional {field} {inType}"
+                )
+            parts.append(addString)
+        sql = " AND ".join(parts)
+        self._rendered = (shapes, sql)
+        return sql
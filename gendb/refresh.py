@@ -0,0 +1,95 @@
+# Python Libaries
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+### User Modules
+from .log import get_logger
+from .paging import decode_value, encode_value
+from .rows import field_getter
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Incremental refresh state
+# SQLServer.refresh keeps the highest watermark value it has seen (an updated_at datetime,
+# a rowversion, an increasing id). When a state file is given the watermark is written to
+# it after every refresh and read back on the first refresh of a new process:
+#
+# {"field": "updated_at", "keys": ["id"], "watermark": {"dt": "2024-01-01T10:00:00"}, ...}
+
+
+# rows are a list of dictionaries or a RowList, result and rows share the same row format
+
+
+def max_watermark(rows, field, current=None):
+    # Highest non NULL value of field in rows, starting from current
+    get = field_getter(rows, field)
+    mark = current
+    for row in rows:
+        value = get(row)
+        if value is not None and (mark is None or value > mark):
+            mark = value
+    return mark
+
+
+def key_getter(rows, keyFields):
+    # Function returning the key of one row: a value, or a tuple for several key fields
+    getters = [field_getter(rows, k) for k in keyFields]
+    if len(getters) == 1:
+        return getters[0]
+    return lambda row: tuple(get(row) for get in getters)
+
+
+def merge_rows(result, rows, keyFields):
+    # Upserts rows into the list result by key, returns (inserted, updated)
+    row_key = key_getter(rows, keyFields)
+    positions = {row_key(row): pos for pos, row in enumerate(result)}
+    inserted = 0
+    updated = 0
+    for row in rows:
+        key = row_key(row)
+        pos = positions.get(key)
+        if pos is None:
+            positions[key] = len(result)
+            result.append(row)
+            inserted += 1
+        else:
+            result[pos] = row
+            updated += 1
+    return inserted, updated
+
+
+def load_watermark(stateFile, field):
+    # Saved watermark for field, None when there is no usable state
+    stateFile = Path(stateFile)
+    if not stateFile.is_file():
+        return None
+    try:
+        with open(stateFile, encoding="utf8") as fd:
+            state = json.load(fd)
+    except Exception as e:
+        logger.error(f"Error! Unable to read refresh state {stateFile}: {e}")
+        return None
+    if state.get("field") != field:
+        logger.error(
+            f"Error! Refresh state {stateFile} was saved for {state.get('field')}, not {field}"
+        )
+        return None
+    return decode_value(state.get("watermark"))
+
+
+def save_watermark(stateFile, field, keyFields, watermark):
+    # Written to a temporary file first so a crash never leaves a half written state
+    stateFile = Path(stateFile)
+    state = {
+        "field": field,
+        "keys": list(keyFields),
+        "watermark": encode_value(watermark),
+        "saved": datetime.now().isoformat(),
+    }
+    tmpFile = stateFile.with_name(stateFile.name + ".tmp")
+    with open(tmpFile, "w", encoding="utf8") as fd:
+        json.dump(state, fd)
+    os.replace(tmpFile, stateFile)
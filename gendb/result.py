@@ -0,0 +1,70 @@
+### Columnar result container
+# Stores one list per column plus a shared column index instead of a dictionary per row.
+# Rows are still available as dictionaries (result[0], iteration), but column access,
+# select and rename do not copy any row data.
+#
+# res = ColumnarResult(["id", "name"])
+# res.append_rows([(1, "a"), (2, "b")])
+# res.column("id")          # [1, 2] (the stored list, not a copy)
+# res.select(["name"])      # new view sharing the "name" column
+# res.rename({"id": "key"}) # new view sharing every column
+
+
+class ColumnarResult:
+    def __init__(self, columns, data=None):
+        self.columns = list(columns)
+        self._index = {name: pos for pos, name in enumerate(self.columns)}
+        if data is None:
+            data = [list() for _ in self.columns]
+        self._data = data
+
+    ###### Row Access ######
+    def __len__(self):
+        if not self._data:
+            return 0
+        return len(self._data[0])
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self._row(i) for i in range(*pos.indices(len(self)))]
+        if pos < 0:
+            pos += len(self)
+        if pos < 0 or pos >= len(self):
+            raise IndexError("ColumnarResult index out of range")
+        return self._row(pos)
+
+    def __iter__(self):
+        columns = self.columns
+        for values in zip(*self._data):
+            yield dict(zip(columns, values))
+
+    def __repr__(self):
+        return f"ColumnarResult(columns={self.columns}, rows={len(self)})"
+
+    def _row(self, pos):
+        return {name: col[pos] for name, col in zip(self.columns, self._data)}
+
+    ###### Methods ######
+    def append_rows(self, rows):
+        # Transpose a batch of row tuples onto the column lists
+        if not rows:
+            return
+        for col, values in zip(self._data, zip(*rows)):
+            col.extend(values)
+
+    def column(self, name):
+        pos = self._index.get(name)
+        if pos is None:
+            return None
+        return self._data[pos]
+
+    def select(self, fieldList):
+        fields = [f for f in fieldList if f in self._index]
+        return ColumnarResult(fields, [self._data[self._index[f]] for f in fields])
+
+    def rename(self, keyDict):
+        # keyDict = {"Old_Name": "New_Name"}
+        return ColumnarResult([keyDict.get(c, c) for c in self.columns], self._data)
+
+    def to_rows(self):
+        return list(self)
@@ -0,0 +1,167 @@
+# Python Libaries
+import keyword
+import re
+from collections import namedtuple
+from functools import lru_cache
+from operator import itemgetter
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Row factories
+# db.settings["row_factory"] picks how run_query stores each row:
+#   "dict"        {"testInt": 10, ...} (default)
+#   "tuple"       (10, ...)            smallest and fastest to build
+#   "namedtuple"  Row(testInt=10, ...) tuple with attribute access
+#   "record"      Row with __slots__   attribute access, fields can be reassigned
+# Row classes are generated once per column list. Results other than dicts are stored in a
+# RowList, a list that also carries the column names so fields can be found by position.
+#
+# db.result.columns             ["testVarCharNull", "testVarChar", ...]
+# db.result[0][3], db.result[0].testInt
+# db.result.column("testInt")   [10, 20, ...]
+
+row_factories = ("dict", "tuple", "namedtuple", "record")
+
+
+def identifiers(columns):
+    # Column names usable as attribute names: other characters become "_", duplicates numbered
+    names = []
+    for pos, column in enumerate(columns):
+        name = re.sub(r"\W", "_", str(column)) or f"field_{pos}"
+        if name[0].isdigit() or keyword.iskeyword(name):
+            name = f"f_{name}"
+        while name in names:
+            name = f"{name}_{pos}"
+        names.append(name)
+    return names
+
+
+def _record_class(names):
+    # exec builds a plain __init__ (as collections.namedtuple and dataclasses do), much faster
+    # than setting attributes in a loop for every row
+    args = ", ".join(names)
+    body = "\n".join(f"    self.{n} = {n}" for n in names) or "    pass"
+    namespace = dict()
+    exec(f"def __init__(self, {args}):\n{body}", namespace)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return tuple(getattr(self, n) for n in names[pos])
+        return getattr(self, names[pos])
+
+    def __iter__(self):
+        for n in names:
+            yield getattr(self, n)
+
+    def __len__(self):
+        return len(names)
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return "Record(" + ", ".join(f"{n}={getattr(self, n)!r}" for n in names) + ")"
+
+    return type(
+        "Record",
+        (),
+        {
+            "__slots__": tuple(names),
+            "_fields": tuple(names),
+            "__init__": namespace["__init__"],
+            "__getitem__": __getitem__,
+            "__iter__": __iter__,
+            "__len__": __len__,
+            "__eq__": __eq__,
+            "__hash__": None,
+            "__repr__": __repr__,
+        },
+    )
+
+
+@lru_cache(maxsize=256)
+def row_class(kind, columns):
+    # columns is a tuple so the generated class can be cached
+    names = identifiers(columns)
+    if kind == "namedtuple":
+        return namedtuple("Row", names, rename=True)
+    if kind == "record":
+        return _record_class(names)
+    return None
+
+
+def row_factory(kind, columns):
+    # Function turning one raw cursor row into the stored row
+    if kind not in row_factories:
+        logger.error(f"Error! Unknown row factory: {kind}. Allowed options: {row_factories}")
+        kind = "dict"
+    if kind == "dict":
+        return lambda row: dict(zip(columns, row))
+    if kind == "tuple":
+        return tuple
+    cls = row_class(kind, tuple(columns))
+    if kind == "namedtuple":
+        return cls._make
+    return lambda row: cls(*row)
+
+
+class RowList(list):
+    # A list of tuple, namedtuple or record rows with the column names of the result
+    def __init__(self, columns, rowFormat, rows=()):
+        super().__init__(rows)
+        self.columns = list(columns)
+        self.rowFormat = rowFormat
+
+    def column(self, name):
+        if name not in self.columns:
+            return None
+        pos = self.columns.index(name)
+        return [row[pos] for row in self]
+
+    def dict_rows(self):
+        columns = self.columns
+        for row in self:
+            yield dict(zip(columns, row))
+
+    def _rebuild(self, columns, positions):
+        factory = row_factory(self.rowFormat, columns)
+        return RowList(
+            columns, self.rowFormat, (factory([row[p] for p in positions]) for row in self)
+        )
+
+    def select(self, fieldList):
+        fields = [f for f in fieldList if f in self.columns]
+        return self._rebuild(fields, [self.columns.index(f) for f in fields])
+
+    def with_column(self, name, value):
+        # New RowList with a column holding value appended to every row
+        columns = self.columns + [name]
+        factory = row_factory(self.rowFormat, columns)
+        return RowList(columns, self.rowFormat, (factory(tuple(row) + (value,)) for row in self))
+
+    def rename(self, keyDict):
+        # keyDict = {"Old_Name": "New_Name"}, tuples only need new column names
+        columns = [keyDict.get(c, c) for c in self.columns]
+        if self.rowFormat == "tuple":
+            return RowList(columns, self.rowFormat, self)
+        return self._rebuild(columns, list(range(len(columns))))
+
+
+def field_getter(result, field):
+    # Function reading field from one row of result for any row format, None when it is missing
+    if isinstance(result, RowList):
+        if field not in result.columns:
+            return lambda row: None
+        return itemgetter(result.columns.index(field))
+    return lambda row: row.get(field)
+
+
+def iter_dicts(result):
+    # Rows of any result as dictionaries
+    if isinstance(result, RowList):
+        return result.dict_rows()
+    return iter(result)
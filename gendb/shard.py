@@ -0,0 +1,120 @@
+# Python Libaries
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+### User Modules
+from .log import get_logger
+from .db import SQLServer
+from .rows import RowList, field_getter, iter_dicts
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Example Usage
+# shards = {"east": eastEnv, "west": westEnv}
+# sq = ShardedQuery(shards, sql="SELECT * FROM testTable WHERE 1 = 1 ", conditions={"testInt": (">", 10)})
+# sq.run()                                   # concatenated in shard order
+# sq.run(merge="sorted", sortKey="testInt")  # k-way merge, each shard must return rows sorted by the key
+# sq.errors  # {"west": Exception(...)} for shards that failed, the other shards are still merged
+###
+
+
+def _sort_key(sortKey, result, reverse=False):
+    # result is one shard's rows, used to read the fields for its row format
+    fields = [sortKey] if isinstance(sortKey, str) else list(sortKey)
+    getters = [field_getter(result, f) for f in fields]
+
+    # NULLs sort last so rows with missing values can still be compared, the flag is flipped
+    # for a reversed merge so they stay last
+    def key(row):
+        values = [get(row) for get in getters]
+        return tuple(((v is None) != reverse, v) for v in values)
+
+    return key
+
+
+class ShardedQuery:
+    def __init__(self, envs, sql="", inVars=None, conditions=None, dbg=False, maxWorkers=None):
+        # envs is a dictionary of {shard name: env} or a list of env dictionaries
+        if isinstance(envs, dict):
+            self.envs = dict(envs)
+        else:
+            self.envs = {index: env for index, env in enumerate(envs)}
+        self.sql = sql
+        self.vars = inVars
+        self.conditions = conditions
+        self.debug = dbg
+        self.maxWorkers = maxWorkers
+        self.settings = dict()  # copied onto every shard's SQLServer.settings
+        self.result = list()
+        self.errors = dict()
+        self.shardStats = dict()
+
+    ###### Methods ######
+    def _run_shard(self, name):
+        started = time.monotonic()
+        inVars = list(self.vars) if isinstance(self.vars, list) else self.vars
+        db = SQLServer(env=self.envs[name], sql=self.sql, inVars=inVars, dbg=self.debug)
+        db.settings.update(self.settings)
+        if self.conditions:
+            db.add_conditional_dict(self.conditions)
+        db.run_query()
+        if db.error is not None:
+            raise db.error
+        self.shardStats[name] = {"rows": len(db.result), "seconds": time.monotonic() - started}
+        return db.result
+
+    def run(self, merge="concat", sortKey=None, reverse=False, shardField=None):
+        # merge: "concat" appends shard results in shard order, "sorted" k-way merges them on sortKey
+        # shardField: adds the shard name to every row under this key
+        if merge not in ("concat", "sorted"):
+            logger.error(f"Sharded Query: unknown merge option {merge}")
+            return
+        if merge == "sorted" and not sortKey:
+            logger.error(f"Sharded Query: merge='sorted' requires a sortKey")
+            return
+
+        names = list(self.envs.keys())
+        logger.info(f"Sharded Query: running {len(names)} shards")
+        self.errors = dict()
+        self.shardStats = dict()
+
+        workers = self.maxWorkers or max(len(names), 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(self._run_shard, name) for name in names}
+
+        shardResults = []
+        for name in names:
+            try:
+                rows = futures[name].result()
+            except Exception as e:
+                logger.error(f"Sharded Query: shard {name} failed: {e}")
+                self.errors[name] = e
+                continue
+            if shardField:
+                if isinstance(rows, RowList):
+                    rows = rows.with_column(shardField, name)
+                else:
+                    # columnar, numpy and spill results build a new dict per row on every read
+                    if not isinstance(rows, list):
+                        rows = list(iter_dicts(rows))
+                    for row in rows:
+                        row[shardField] = name
+            shardResults.append(rows)
+
+        if merge == "sorted" and shardResults:
+            key = _sort_key(sortKey, shardResults[0], reverse)
+            merged = heapq.merge(*shardResults, key=key, reverse=reverse)
+        else:
+            merged = (row for rows in shardResults for row in rows)
+        if shardResults and isinstance(shardResults[0], RowList):
+            # tuple, namedtuple and record rows keep their column names
+            self.result = RowList(shardResults[0].columns, shardResults[0].rowFormat, merged)
+        else:
+            self.result = list(merged)
+
+        logger.info(
+            f"Sharded Query: {len(self.result)} rows from {len(shardResults)} shards, {len(self.errors)} failed"
+        )
+        return self.result
@@ -0,0 +1,167 @@
+# Python Libaries
+import pickle
+import tempfile
+from bisect import bisect_right
+
+### User Modules
+from .log import get_logger
+from .trace import estimate_bytes
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Spill to disk result container
+# Rows are kept in memory until their estimated size passes half the budget, then that batch
+# of rows is pickled as one segment onto a temporary file and the buffer starts again. Reading
+# loads one segment at a time, so memory stays around the budget however large the result is.
+#
+# res = SpillResult(["id", "name"], budget=64 * 1024 * 1024)
+# res.append_rows(cursor.fetchmany(1000))
+# res[0], len(res), iteration       # rows as dictionaries, spilled segments read back lazily
+# res.column("id")                  # list of one column, read segment by segment
+# res.select(["name"]) / res.rename({"id": "key"})   # views sharing the same spill file
+# res.close()                       # removes the temporary file (also done on garbage collect)
+
+
+class SpillStore:
+    def __init__(self, budget, spillDir=None):
+        self.budget = budget
+        self.spillDir = spillDir
+        self._file = None
+        self._segments = list()  # (offset, size, rowCount)
+        self._starts = list()  # first row position of each segment
+        self._spilledRows = 0
+        self._buffer = list()
+        self._bufferBytes = 0
+        self._loaded = (None, None)  # (segment number, rows) of the last segment read
+
+    def __len__(self):
+        return self._spilledRows + len(self._buffer)
+
+    @property
+    def spilled(self):
+        return self._spilledRows
+
+    def append(self, rows):
+        self._buffer.extend(tuple(row) for row in rows)
+        self._bufferBytes += estimate_bytes(rows)
+        if self._bufferBytes > self.budget // 2:
+            self._spill()
+
+    def _spill(self):
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="gendb_spill_", dir=self.spillDir)
+            logger.info(f"Spilling result rows to disk: budget {self.budget} bytes")
+        data = pickle.dumps(self._buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        offset = self._file.seek(0, 2)
+        self._file.write(data)
+        self._segments.append((offset, len(data), len(self._buffer)))
+        self._starts.append(self._spilledRows)
+        self._spilledRows += len(self._buffer)
+        self._buffer = list()
+        self._bufferBytes = 0
+
+    def _segment(self, number):
+        if self._loaded[0] == number:
+            return self._loaded[1]
+        offset, size, _ = self._segments[number]
+        self._file.seek(offset)
+        rows = pickle.loads(self._file.read(size))
+        self._loaded = (number, rows)
+        return rows
+
+    def row(self, pos):
+        if pos >= self._spilledRows:
+            return self._buffer[pos - self._spilledRows]
+        number = bisect_right(self._starts, pos) - 1
+        return self._segment(number)[pos - self._starts[number]]
+
+    def __iter__(self):
+        for number in range(len(self._segments)):
+            offset, size, _ = self._segments[number]
+            self._file.seek(offset)
+            # not kept in self._loaded, a full scan should not pin the last segment
+            for row in pickle.loads(self._file.read(size)):
+                yield row
+        for row in self._buffer:
+            yield row
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._segments = list()
+        self._starts = list()
+        self._spilledRows = 0
+        self._buffer = list()
+        self._bufferBytes = 0
+        self._loaded = (None, None)
+
+
+class SpillResult:
+    def __init__(
+        self, columns, budget=256 * 1024 * 1024, spillDir=None, store=None, positions=None
+    ):
+        self.columns = list(columns)
+        self._index = {name: pos for pos, name in enumerate(self.columns)}
+        self._store = store if store is not None else SpillStore(budget, spillDir)
+        # position of each column inside the stored row tuples, views reorder without copying
+        self._positions = positions if positions is not None else list(range(len(self.columns)))
+
+    ###### Row Access ######
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self._row(self._store.row(i)) for i in range(*pos.indices(len(self)))]
+        if pos < 0:
+            pos += len(self)
+        if pos < 0 or pos >= len(self):
+            raise IndexError("SpillResult index out of range")
+        return self._row(self._store.row(pos))
+
+    def __iter__(self):
+        for row in self._store:
+            yield self._row(row)
+
+    def __repr__(self):
+        return f"SpillResult(columns={self.columns}, rows={len(self)}, spilled={self.spilled})"
+
+    def _row(self, row):
+        return {name: row[p] for name, p in zip(self.columns, self._positions)}
+
+    ###### Methods ######
+    @property
+    def spilled(self):
+        return self._store.spilled
+
+    def append_rows(self, rows):
+        if rows:
+            self._store.append(rows)
+
+    def column(self, name):
+        pos = self._index.get(name)
+        if pos is None:
+            return None
+        stored = self._positions[pos]
+        return [row[stored] for row in self._store]
+
+    def select(self, fieldList):
+        fields = [f for f in fieldList if f in self._index]
+        return SpillResult(
+            fields,
+            store=self._store,
+            positions=[self._positions[self._index[f]] for f in fields],
+        )
+
+    def rename(self, keyDict):
+        # keyDict = {"Old_Name": "New_Name"}
+        return SpillResult(
+            [keyDict.get(c, c) for c in self.columns], store=self._store, positions=self._positions
+        )
+
+    def close(self):
+        self._store.close()
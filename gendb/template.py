@@ -0,0 +1,119 @@
+# Python Libaries
+import os
+import re
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### SQL templates
+# .sql files are read once and kept until their modification time or size changes, so creating
+# an SQLServer from a file costs a stat instead of a read. Named parameters are compiled once
+# into "?" placeholders with the parameter order remembered:
+#
+# template = get_template("orders.sql")   # SELECT * FROM orders WHERE id = :id AND :id > 0
+# template.sql                            # SELECT * FROM orders WHERE id = ? AND ? > 0
+# template.params                         # ("id", "id")
+# template.bind({"id": 5})                # [5, 5]
+#
+# db = SQLServer(env, sql="orders.sql", inVars={"id": 5})   # or db.vars = {"id": 5}
+#
+# ":name" inside quotes, [brackets] and comments is left alone, as is a "::type" cast.
+
+_tokens = re.compile(
+    r"'(?:[^']|'')*'"  # 'string literal'
+    r'|"(?:[^"]|"")*"'  # "quoted identifier"
+    r"|\[[^\]]*\]"  # [bracketed identifier]
+    r"|--[^\n]*"  # line comment
+    r"|/\*.*?\*/"  # block comment
+    r"|::"  # postgres cast
+    r"|(?<![\w:]):([A-Za-z_]\w*)",  # :name
+    re.DOTALL,
+)
+
+
+def mask_sql(text):
+    # text with string literals, quoted and bracketed identifiers and comments blanked out (same
+    # length), so keywords and parentheses can be found by position
+    def blank(match):
+        if match.group(1) is not None:
+            return match.group(0)
+        return " " * len(match.group(0))
+
+    return _tokens.sub(blank, text)
+
+
+class SqlTemplate:
+    def __init__(self, text):
+        self.text = text
+        params = []
+
+        def replace(match):
+            if match.group(1) is None:
+                return match.group(0)
+            params.append(match.group(1))
+            return "?"
+
+        self.sql = _tokens.sub(replace, text)
+        self.params = tuple(params)
+
+    def __repr__(self):
+        return f"SqlTemplate(params={self.params})"
+
+    def bind(self, values):
+        # Positional values in placeholder order, a name used twice is bound twice
+        missing = [p for p in dict.fromkeys(self.params) if p not in values]
+        if missing:
+            raise KeyError(f"SqlTemplate: no value for parameters {missing}")
+        return [values[p] for p in self.params]
+
+
+@lru_cache(maxsize=512)
+def compile_sql(text):
+    return SqlTemplate(text)
+
+
+class TemplateRegistry:
+    def __init__(self):
+        self._templates = dict()  # path -> ((mtime_ns, size), SqlTemplate)
+        self._lock = threading.Lock()
+        self.stats = {"loads": 0, "hits": 0}
+
+    def get(self, path):
+        fullPath = str(Path(path).resolve())
+        stat = os.stat(fullPath)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._templates.get(fullPath)
+            if cached is not None and cached[0] == version:
+                self.stats["hits"] += 1
+                return cached[1]
+
+        logger.info(f"Loading SQL Template File: {fullPath}")
+        with open(fullPath, "r") as fd:
+            template = SqlTemplate(fd.read())
+        with self._lock:
+            self._templates[fullPath] = (version, template)
+            self.stats["loads"] += 1
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._templates = dict()
+
+
+### Process wide registry used by SQLServer
+_registry = TemplateRegistry()
+
+
+def get_template(path):
+    return _registry.get(path)
+
+
+def template_registry():
+    return _registry
@@ -0,0 +1,110 @@
+# Python Libaries
+import sys
+import threading
+import time
+
+### User Modules
+from .log import get_logger
+
+logger = get_logger(f"{__package__}.{__name__}")
+
+
+### Example Usage
+# tracer = TraceCollector()          # or TraceCollector(callback=lambda span: print(span))
+# db.tracer = tracer                 # per instance
+# set_global_tracer(tracer)          # or for every instance without its own tracer
+# db.run_query()
+# tracer.summary()  # {"connect": {"count": 1, "seconds": ...}, "execute": ..., "fetch": ..., ...}
+#
+# Phases recorded by SQLServer: connect, execute, describe, fetch, transform
+# Any object with record(phase, start, seconds, rows=None, bytes=None) can be used as a tracer.
+# When no tracer is set nothing is timed or measured.
+###
+
+
+class Span:
+    __slots__ = ("phase", "start", "seconds", "rows", "bytes")
+
+    def __init__(self, phase, start, seconds, rows=None, bytes=None):
+        self.phase = phase
+        self.start = start  # time.monotonic() when the phase began
+        self.seconds = seconds
+        self.rows = rows
+        self.bytes = bytes
+
+    def __repr__(self):
+        return f"Span({self.phase}, {self.seconds:.6f}s, rows={self.rows}, bytes={self.bytes})"
+
+
+class TraceCollector:
+    def __init__(self, callback=None, keep=True):
+        self.callback = callback
+        self.keep = keep
+        self.spans = list()
+        self._lock = threading.Lock()
+
+    def record(self, phase, start, seconds, rows=None, bytes=None):
+        span = Span(phase, start, seconds, rows, bytes)
+        if self.keep:
+            with self._lock:
+                self.spans.append(span)
+        if self.callback is not None:
+            self.callback(span)
+        return span
+
+    def summary(self):
+        phases = dict()
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            total = phases.setdefault(
+                span.phase, {"count": 0, "seconds": 0.0, "rows": 0, "bytes": 0}
+            )
+            total["count"] += 1
+            total["seconds"] += span.seconds
+            total["rows"] += span.rows or 0
+            total["bytes"] += span.bytes or 0
+        return phases
+
+    def clear(self):
+        with self._lock:
+            self.spans = list()
+
+
+### Helpers used around each phase, both are no-ops when tracer is None
+def start_span(tracer):
+    if tracer is None:
+        return None
+    return time.monotonic()
+
+
+def finish_span(tracer, phase, started, rows=None, bytes=None):
+    if tracer is None:
+        return
+    tracer.record(phase, started, time.monotonic() - started, rows, bytes)
+
+
+def estimate_bytes(rows, sample=20):
+    # Approximate size of a batch of rows from the first few, never walks every row
+    count = len(rows)
+    if not count:
+        return 0
+    sampled = [rows[i] for i in range(min(count, sample))]
+    size = 0
+    for row in sampled:
+        values = row.values() if isinstance(row, dict) else row
+        size += sys.getsizeof(row) + sum(sys.getsizeof(v) for v in values)
+    return int(size / len(sampled) * count)
+
+
+### Process wide tracer used by instances that do not set their own
+_globalTracer = None
+
+
+def set_global_tracer(tracer):
+    global _globalTracer
+    _globalTracer = tracer
+
+
+def get_global_tracer():
+    return _globalTracer
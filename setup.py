@@ -22,6 +22,11 @@ setup(
         "setuptools_git >= 1",
     ],
     install_requires=requirements,
+    extras_require={
+        "arrow": ["pyarrow>=4"],
+        "numpy": ["numpy>=1.17"],
+        "zstd": ["zstandard"],
+    },
     python_requires=">=3.5",
     classifiers=[
         "Programming Language :: Python :: 3.9",
@@ -18,6 +18,17 @@ CREATE TABLE [master].[dbo].[testTable](
 
 """
 
+createBulkTable = """ 
+IF OBJECT_ID('[master].[dbo].[testBulkTable]', 'U') IS NOT NULL 
+  DROP TABLE [master].[dbo].[testBulkTable]; 
+
+CREATE TABLE [master].[dbo].[testBulkTable](
+	[bulkId] [int] NOT NULL PRIMARY KEY,
+	[bulkName] [nvarchar](50) NULL
+) ON [PRIMARY]
+
+"""
+
 updateTestTable = """
 INSERT INTO [master].[dbo].[testTable](
     testVarCharNull,
@@ -44,6 +55,7 @@ cursor = cnxn.cursor()
 # Create Table
 print("Creating Table")
 cursor.execute(createTable)
+cursor.execute(createBulkTable)
 
 # Add Values
 print("Adding Data")
@@ -29,6 +29,14 @@ def generateDB():
         testFloat real NOT NULL
     ); """
 
+    dropBulkTable = "DROP TABLE IF EXISTS testBulkTable;"
+
+    createBulkTable = """ 
+    CREATE TABLE IF NOT EXISTS testBulkTable ( 
+        bulkId integer PRIMARY KEY,
+        bulkName text
+    ); """
+
     updateTestTable = """
     INSERT INTO testTable(
         testVarCharNull,
@@ -64,6 +72,10 @@ def generateDB():
         print("Creating the Table")
         c.execute(createTestTable)
 
+        print("Creating the Bulk Write Table")
+        c.execute(dropBulkTable)
+        c.execute(createBulkTable)
+
         print("Adding Data")
         for t in testData:
             c.execute(updateTestTable, t)
@@ -5,10 +5,19 @@
 import sys, os
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import asyncio
 from pathlib import Path
 
+import pytest
+
 ## Import modules to test
 from gendb.db import SQLServer
+from gendb.aio import AsyncSQLServer, gather_queries
+from gendb.shard import ShardedQuery
+from gendb.cache import ResultCache
+from gendb.dialect import Dialect, get_dialect, register_dialect
+from gendb.pool import ConnectionPool
+from gendb.trace import TraceCollector
 
 TEST_OUTPUT_DIR = Path(__file__).resolve().parent / "test_output"
 if not TEST_OUTPUT_DIR.is_dir():
@@ -197,3 +206,815 @@ def test_sql_query_export_json():
 
     fullFilePath = TEST_OUTPUT_DIR / "sqlserver_test_selected.json"
     db.export_json(fullFilePath, ["testVarChar", "testInt"])
+
+
+def test_sql_query_pooled_connection_reused():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    inVars = None
+    db = SQLServer(env=test_env, sql=sql, inVars=inVars, dbg=False)
+    db.settings["pool"] = True
+    before = db.pool_stats()
+    db.run_query()
+    db.run_query()
+    after = db.pool_stats()
+
+    assert len(db.result) == 6
+    assert after["hits"] - before["hits"] >= 1
+    assert after["in_use"] == 0
+
+    # a borrowed connection goes back to the pool it came from
+    conn = db._connect()
+    db.settings["pool"] = False
+    db._release(conn)
+    assert db._pool().stats()["in_use"] == 0
+
+
+def test_sql_pool_health_check_and_min_size():
+    db = SQLServer(env=test_env, sql="SELECT * FROM testTable WHERE 1 = 1 ", dbg=False)
+    connection = db.conn_parameters()["connection"]
+
+    # minSize connections are opened when the pool is created
+    pool = ConnectionPool(connection, minSize=2, maxSize=2)
+    assert pool.stats()["size"] == 2 and pool.stats()["idle"] == 2
+    pool.close()
+
+    # recently returned connections are not checked
+    pool = ConnectionPool(connection, maxSize=1, healthCheck="SELECT * FROM noSuchTable")
+    pool.release(pool.acquire())
+    pool.release(pool.acquire())
+    assert pool.stats()["failed_checks"] == 0
+
+    # a failed check replaces the connection within the same slot
+    pool.checkAfter = 0
+    conn = pool.acquire()
+    stats = pool.stats()
+    assert stats["failed_checks"] == 1 and stats["created"] == 2
+    assert stats["size"] == 1 and stats["in_use"] == 1
+    pool.release(conn)
+    pool.close()
+
+    # idle connections past idleTimeout are evicted on the next checkout
+    pool = ConnectionPool(connection, maxSize=2, idleTimeout=0)
+    first = pool.acquire()
+    pool.release(first)
+    second = pool.acquire()
+    assert second is not first
+    assert pool.stats()["evicted"] == 1 and pool.stats()["size"] == 1
+    pool.release(second)
+    pool.close()
+
+    assert get_dialect("oracle").pingQuery == "SELECT 1 FROM DUAL"
+
+
+def test_sql_query_iter_query_streams_rows():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    inVars = None
+    db = SQLServer(env=test_env, sql=sql, inVars=inVars, dbg=False)
+    db.add_conditional("testInt", "!=", 10)
+
+    rows = list(db.iter_query(batchSize=2))
+    batches = list(db.iter_query(batchSize=2, batches=True))
+    streamed = list(db.run_query(stream=True))
+
+    assert len(rows) == 5
+    assert len(streamed) == 5
+    assert "testInt" in rows[0]
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert db.result == []
+
+
+def test_sql_query_columnar_result():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    inVars = None
+    db = SQLServer(env=test_env, sql=sql, inVars=inVars, dbg=False)
+    db.settings["columnar"] = True
+    db.run_query()
+
+    assert len(db.result) == 6
+    assert len(db.get_fields()) == len(db.result[0])
+    assert db.get_field_data("testInt") is db.result.column("testInt")
+
+    subResults = db.select_fields(["testVarChar", "testInt"])
+    assert set(subResults[0].keys()) == set(["testVarChar", "testInt"])
+
+    db.rename_fields({"testInt": "rename1"})
+    assert db.get_field_data("rename1") == [10, 20, 30, 40, 50, 60]
+
+    db.export_json(TEST_OUTPUT_DIR / "sqlserver_test_columnar.json")
+
+
+def test_sql_query_export_ndjson():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    inVars = None
+    db = SQLServer(env=test_env, sql=sql, inVars=inVars, dbg=False)
+    db.run_query()
+
+    fullFilePath = TEST_OUTPUT_DIR / "sqlserver_test.ndjson"
+    db.export_ndjson(fullFilePath)
+    with open(fullFilePath) as fd:
+        assert len(fd.readlines()) == 6
+
+
+def test_sql_query_stream_csv_and_ndjson():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    inVars = None
+    db = SQLServer(env=test_env, sql=sql, inVars=inVars, dbg=False)
+
+    fullFilePath = TEST_OUTPUT_DIR / "sqlserver_test_stream_selected.csv"
+    assert db.stream_csv(fullFilePath, ["testVarChar", "testInt"], batchSize=4) == 6
+    with open(fullFilePath) as fd:
+        lines = fd.read().splitlines()
+    assert lines[0] == "testVarChar,testInt"
+    assert len(lines) == 7
+
+    fullFilePath = TEST_OUTPUT_DIR / "sqlserver_test_stream.ndjson"
+    assert db.stream_ndjson(fullFilePath, batchSize=4) == 6
+    assert db.result == []
+
+
+def test_sql_query_builder_bind_many():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    inVars = None
+    db = SQLServer(env=test_env, sql=sql, inVars=inVars, dbg=False)
+
+    qb = db.query_builder()
+    qb.add_conditional("testInt", "!=", 10)
+    qb.add_conditional("testIntNull", "<", 4)
+    firstSql = qb.sql
+    assert qb.vars == [10, 4]
+
+    results = db.run_builder(qb, [[10, 4], [20, 6], [60, 1]])
+    assert qb.bind([20, 6])[0] is firstSql
+    assert [len(r) for r in results] == [2, 4, 0]
+
+    # conditionals added to the instance before the builder keep their values
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.add_conditional("testVarChar", "!=", "vc10")
+    qb = db.query_builder()
+    assert qb.vars == ["vc10"]
+    qb.add_conditional("testInt", "<", 50)
+    assert qb.vars == ["vc10", 50]
+    assert [len(r) for r in db.run_builder(qb)] == [3]
+    assert [len(r) for r in db.run_builder(qb, [[40], [60]])] == [2, 4]
+
+
+def test_sql_query_add_conditional_dict():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    inVars = None
+    db = SQLServer(env=test_env, sql=sql, inVars=inVars, dbg=False)
+    db.add_conditional_dict({"testVarChar": ("=", "vc10"), "testIntNull": ("!=", None)})
+    db.run_query()
+
+    assert db.vars == ["vc10"]
+    assert len(db.result) == 1
+
+
+def test_sql_bulk_insert_and_upsert():
+    sql = "SELECT * FROM testBulkTable WHERE 1 = 1 "
+    inVars = None
+    db = SQLServer(env=test_env, sql=sql, inVars=inVars, dbg=False)
+
+    db.bulk_upsert(
+        "testBulkTable", [{"bulkId": i, "bulkName": f"n{i}"} for i in range(1, 4)], ["bulkId"]
+    )
+    stats = db.bulk_upsert(
+        "testBulkTable", [(3, "updated"), (4, "n4")], ["bulkId"], fields=["bulkId", "bulkName"]
+    )
+    assert stats["rows"] == 2
+
+    db.bulk_execute("DELETE FROM testBulkTable WHERE bulkId = ?", [(10,), (11,)])
+    stats = db.bulk_insert(
+        "testBulkTable", ({"bulkId": i, "bulkName": "new"} for i in (10, 11)), chunkSize=1
+    )
+    assert stats["rows"] == 2
+    assert stats["chunks"] == 2
+
+    db.run_query()
+    assert len(db.result) == 6
+    assert [r["bulkName"] for r in db.result if r["bulkId"] == 3] == ["updated"]
+
+    # a failing chunk stops the write, the committed rows and the error are reported
+    db.bulk_execute("DELETE FROM testBulkTable WHERE bulkId = ?", [(20,), (21,)])
+    stats = db.bulk_insert(
+        "testBulkTable", [(20, "a"), (21, "b"), (20, "duplicate")], ["bulkId", "bulkName"], 2
+    )
+    assert stats["rows"] == 2
+    assert stats["error"] is not None
+    assert db.error is stats["error"]
+    stats = db.bulk_execute("DELETE FROM testBulkTable WHERE bulkId = ?", [(20,), (21,)])
+    assert stats["error"] is None and db.error is None
+
+
+def test_sql_query_async_run_and_gather():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+
+    async def run():
+        dbs = [AsyncSQLServer(env=test_env, sql=sql, maxWorkers=4) for _ in range(3)]
+        dbs[1].add_conditional("testInt", "!=", 10)
+        dbs[2].vars = None
+        results = await gather_queries([db.run_query() for db in dbs], limit=2)
+
+        rows = [row async for row in dbs[0].iter_query(batchSize=4)]
+        return results, rows
+
+    results, rows = asyncio.run(run())
+    assert [len(r) for r in results] == [6, 5, 6]
+    assert len(rows) == 6
+
+    # a failing query raises instead of returning the previous result
+    async def run_failing():
+        good = AsyncSQLServer(env=test_env, sql=sql, maxWorkers=4)
+        bad = AsyncSQLServer(env=test_env, sql="SELECT * FROM noSuchTable", maxWorkers=4)
+        bad.result = [{"stale": 1}]
+        return await gather_queries([good.run_query(), bad.run_query()], return_exceptions=True)
+
+    good, bad = asyncio.run(run_failing())
+    assert len(good) == 6
+    assert isinstance(bad, Exception)
+
+
+def test_sql_query_sharded_fan_out():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    badEnv = dict(test_env, database="missingDatabase")
+    shards = {"first": test_env, "second": dict(test_env), "broken": badEnv}
+
+    sq = ShardedQuery(shards, sql=sql, conditions={"testInt": ("<", 40)})
+    sq.run(shardField="shard")
+    assert len(sq.result) == 6
+    assert set(sq.errors.keys()) == set(["broken"])
+    assert set(r["shard"] for r in sq.result) == set(["first", "second"])
+
+    sq.sql = "SELECT * FROM testTable WHERE testInt < 40 ORDER BY testInt"
+    sq.conditions = None
+    sq.run(merge="sorted", sortKey="testInt")
+    assert [r["testInt"] for r in sq.result] == [10, 10, 20, 20, 30, 30]
+
+    # NULLs stay last in a reversed merge
+    sq.sql = "SELECT * FROM testTable WHERE 1 = 1 ORDER BY testIntNull DESC"
+    sq.run(merge="sorted", sortKey="testIntNull", reverse=True)
+    assert [r["testIntNull"] for r in sq.result][-3:] == [1, None, None]
+
+    # tuple rows are read by position and get the shard name as a new column
+    sq.settings["row_factory"] = "tuple"
+    sq.sql = "SELECT * FROM testTable WHERE testInt < 40 ORDER BY testInt"
+    sq.run(merge="sorted", sortKey="testInt", shardField="shard")
+    assert set(sq.errors.keys()) == set(["broken"])
+    assert sq.result.columns[-1] == "shard"
+    assert [r[3] for r in sq.result] == [10, 10, 20, 20, 30, 30]
+    assert set(r[-1] for r in sq.result) == set(["first", "second"])
+
+    # columnar results are tagged as dict rows
+    sq.settings = {"columnar": True}
+    sq.run(merge="sorted", sortKey="testInt", shardField="shard")
+    assert [r["testInt"] for r in sq.result] == [10, 10, 20, 20, 30, 30]
+    assert set(r["shard"] for r in sq.result) == set(["first", "second"])
+
+
+def test_sql_query_result_cache():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    cache = ResultCache(ttl=60, maxEntries=10)
+
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.settings["cache"] = cache
+    db.settings["cache_tags"] = ["testTable"]
+    db.add_conditional("testInt", "!=", 10)
+    db.run_query()
+
+    db2 = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db2.settings["cache"] = cache
+    db2.add_conditional("testInt", "!=", 10)
+    db2.settings["pool"] = True
+    before = db2.pool_stats()
+    db2.run_query()
+
+    assert len(db2.result) == 5
+    assert db2.pool_stats() == before
+    assert cache.stats()["hits"] == 1
+    assert cache.invalidate("testTable") == 1
+    assert cache.stats()["entries"] == 0
+
+    # the same instance runs again with the same parameters and hits the cache
+    db.run_query()
+    db.run_query()
+    assert db.error is None
+    assert db.vars == [10]
+    assert len(db.result) == 5
+    assert cache.stats()["hits"] == 2
+
+    # the row format is part of the key, tuple rows are never handed to a dict instance
+    db.settings["row_factory"] = "tuple"
+    db.run_query()
+    assert db.result.rowFormat == "tuple"
+    db.settings["row_factory"] = "dict"
+    db.run_query()
+    assert isinstance(db.result[0], dict)
+
+    # cached rows are copies, changing a result does not change the cache
+    db.result[0]["testInt"] = -1
+    db.run_query()
+    assert db.result[0]["testInt"] != -1
+    assert cache.stats()["hits"] == 4
+
+
+def test_sql_dialect_resolved_once():
+    db = SQLServer(env=test_env, sql="SELECT * FROM testTable WHERE 1 = 1 ", dbg=False)
+    assert db.dialect.name == "sqlserver"
+
+    register_dialect(
+        Dialect("custom", "Custom Test Driver", casts={"int": "CAST({field} AS NUMBER)"})
+    )
+    db.env = {"driver": "{Custom Test Driver}"}
+    db.add_conditional("testInt", ">", 10)
+    assert db.dialect.name == "custom"
+    assert db.sql.endswith("AND CAST(testInt AS NUMBER) > ?")
+
+
+def test_sql_query_trace_phases():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    spans = []
+    db.tracer = TraceCollector(callback=spans.append)
+    db.run_query()
+
+    summary = db.tracer.summary()
+    assert set(summary.keys()) == set(["connect", "execute", "describe", "fetch", "transform"])
+    assert summary["fetch"]["rows"] == 6
+    assert summary["fetch"]["bytes"] > 0
+    assert len(spans) == 5
+
+    db.tracer.clear()
+    list(db.iter_query(batchSize=4))
+    assert db.tracer.summary()["fetch"]["count"] == 2
+
+
+def test_sql_query_paginate_keyset():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.add_conditional("testInt", "!=", 10)
+
+    pages = list(db.paginate("testInt", page_size=2))
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert [r["testInt"] for p in pages for r in p] == [20, 30, 40, 50, 60]
+    assert pages[-1].token is None
+
+    resumed = list(db.paginate("testInt", page_size=2, token=pages[0].token))
+    assert [r["testInt"] for p in resumed for r in p] == [40, 50, 60]
+    assert [p.number for p in resumed] == [2, 3]
+
+    # a token that does not decode or was made for another order by is an error, not an end
+    with pytest.raises(ValueError):
+        list(db.paginate("testInt", page_size=2, token="not a token"))
+    with pytest.raises(ValueError):
+        list(db.paginate("testInt DESC", page_size=2, token=pages[0].token))
+
+    pages = list(db.paginate(["testVarChar DESC", "testInt"], page_size=4))
+    assert [r["testInt"] for p in pages for r in p] == [30, 20, 50, 40, 60]
+
+
+def test_sql_query_stream_arrow_and_parquet():
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+
+    fullFilePath = TEST_OUTPUT_DIR / "sqlserver_test.arrow"
+    assert db.stream_arrow(fullFilePath, batchSize=4) == 6
+    table = pa.ipc.open_file(str(fullFilePath)).read_all()
+    assert table.num_rows == 6
+    assert table.schema.field("testInt").type == pa.int64()
+    assert table.column("testIntNull").null_count == 1
+
+    fullFilePath = TEST_OUTPUT_DIR / "sqlserver_test_selected.parquet"
+    assert db.stream_parquet(fullFilePath, ["testVarChar", "testFloat"]) == 6
+    table = pq.read_table(str(fullFilePath))
+    assert table.column_names == ["testVarChar", "testFloat"]
+    assert table.schema.field("testFloat").type == pa.float64()
+
+    # fetch batches are buffered into row groups of rowGroupSize rows
+    fullFilePath = TEST_OUTPUT_DIR / "sqlserver_test_row_groups.parquet"
+    assert db.stream_parquet(fullFilePath, batchSize=1, rowGroupSize=4) == 6
+    metadata = pq.ParquetFile(str(fullFilePath)).metadata
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [4, 2]
+
+
+def test_sql_query_numpy_result():
+    np = pytest.importorskip("numpy")
+
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.settings["numpy"] = True
+    db.settings["batch_size"] = 4
+    db.run_query()
+
+    assert len(db.result) == 6
+    assert db.result[5]["testIntNull"] is None
+    testInt = db.get_field_data("testInt")
+    assert testInt.dtype == np.int64
+    assert testInt.tolist() == [10, 20, 30, 40, 50, 60]
+    assert db.get_field_data("testIntNull").mask.tolist() == [False] * 5 + [True]
+
+    assert len(db.result.filter("testIntNull", "<", 3)) == 2
+    assert db.result.aggregate("testIntNull", "sum") == 15
+    assert db.result.aggregate("testIntNull", "count") == 5
+    ordered = db.result.sort(["testVarChar", "testInt"], descending=True)
+    assert ordered.column("testInt").tolist() == [30, 20, 10, 50, 60, 40]
+
+    db.rename_fields({"testInt": "rename1"})
+    assert db.select_fields(["rename1"]).columns == ["rename1"]
+
+
+def test_sql_query_indexed_lookups():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.run_query()
+
+    assert [r["testVarChar"] for r in db.lookup("testInt", 30)] == ["vc30"]
+    assert db.get_index("testInt") is db.get_index("testInt")
+    assert len(db.lookup(["testVarChar", "testIntNull"], ("992", None))) == 1
+    assert db.lookup("testInt", 35) == []
+    assert [r["testInt"] for r in db.range_lookup("testInt", 20, 40)] == [20, 30, 40]
+    assert [r["testInt"] for r in db.range_lookup("testInt", 20, 40, includeLow=False)] == [30, 40]
+    assert [r["testIntNull"] for r in db.range_lookup("testIntNull", low=4)] == [4, 5]
+
+    db.rename_fields({"testInt": "rename1"})
+    assert db.lookup("testInt", 30) == []
+    assert db.lookup("rename1", 30)[0]["testVarChar"] == "vc30"
+
+    db.settings["columnar"] = True
+    db.run_query()
+    assert [r["testInt"] for r in db.range_lookup("testInt", high=20)] == [10, 20]
+
+
+def test_sql_query_spill_to_disk():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.settings["spill"] = True
+    db.settings["spill_budget"] = 1  # spill every batch
+    db.settings["batch_size"] = 2
+    db.run_query()
+
+    assert len(db.result) == 6
+    assert db.result.spilled == 6
+    assert list(db.get_fields()) == [
+        "testVarCharNull",
+        "testVarChar",
+        "testIntNull",
+        "testInt",
+        "testFloatNull",
+        "testFloat",
+    ]
+    assert db.get_field_data("testInt") == [10, 20, 30, 40, 50, 60]
+    assert db.result[3]["testVarCharNull"] == "991"
+    assert db.result[-1]["testIntNull"] is None
+    assert [r["testInt"] for r in db.range_lookup("testInt", 20, 30)] == [20, 30]
+    assert list(db.select_fields(["testInt"]))[1] == {"testInt": 20}
+
+    db.rename_fields({"testInt": "rename1"})
+    db.export_csv(TEST_OUTPUT_DIR / "spill_test.csv")
+    with open(TEST_OUTPUT_DIR / "spill_test.csv") as fd:
+        lines = fd.read().splitlines()
+    assert len(lines) == 7
+    assert "rename1" in lines[0]
+    db.result.close()
+
+
+def test_sql_query_large_in_lists():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    values = [10, 20, 30, 40, 60, 60, 999]
+
+    def run(dialect, inType, threshold):
+        db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+        if dialect is not None:
+            db.dialect = dialect
+        db.settings["in_list_threshold"] = threshold
+        db.add_conditional("testInt", inType, values)
+        db.add_conditional("testIntNull", "!=", None)
+        db.run_query()
+        return db, sorted(r["testInt"] for r in db.result)
+
+    inline, expected = run(None, "in", 100)
+    assert expected == [10, 20, 30, 40]
+
+    # temp table
+    db, result = run(None, "in", 3)
+    assert "(SELECT v FROM" in db.sql
+    assert result == expected
+    db, result = run(None, "not in", 3)
+    assert result == [50]
+
+    # chunked statements for dialects without temp tables
+    chunks = Dialect("chunked", "Chunked Test Driver", maxParams=6)
+    db, result = run(chunks, "in", 3)
+    assert db.sql.count("?") == 3
+    assert result == expected
+    db, result = run(chunks, "not in", 3)
+    assert result == [50]
+
+    # without a threshold a list is rewritten once the whole statement passes maxParams
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.dialect = chunks
+    db.add_conditional("testInt", ">", 0)
+    db.add_conditional("testInt", "in", [10, 20, 30, 40, 50])
+    assert db.sql.count("?") == 6
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.dialect = chunks
+    db.add_conditional("testInt", ">", 0)
+    db.add_conditional("testInt", "in", [10, 20, 30, 40, 50, 60])
+    assert db.sql.count("?") == 1 + 3
+
+    # chunks would split aggregates and row limits, those lists stay inline
+    countSql = "SELECT COUNT(*) AS n FROM testTable WHERE 1 = 1 "
+    db = SQLServer(env=test_env, sql=countSql, inVars=None, dbg=False)
+    db.dialect = chunks
+    db.settings["in_list_threshold"] = 3
+    db.add_conditional("testInt", "in", values)
+    assert db.sql.count("?") == len(values)
+    db.run_query()
+    assert db.result == [{"n": 5}]
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.dialect = chunks
+    db.settings["in_list_threshold"] = 3
+    db.add_conditional("testInt", "in", values)
+    with pytest.raises(ValueError):
+        list(db.paginate("testInt", page_size=2))
+
+    # text values, the SQL Server temp table column takes the database collation
+    from gendb.inlist import temp_table_type
+
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.settings["in_list_threshold"] = 2
+    db.add_conditional("testVarChar", "in", ["vc10", "vc20", "vc30", "missing"])
+    db.run_query()
+    assert sorted(r["testInt"] for r in db.result) == [10, 20, 30]
+    sqlType = temp_table_type(get_dialect("sqlserver"), ["vc10"])
+    assert sqlType.endswith("COLLATE DATABASE_DEFAULT")
+
+
+def test_sql_query_incremental_refresh():
+    sql = "SELECT * FROM testBulkTable WHERE bulkId >= 100 "
+    stateFile = TEST_OUTPUT_DIR / "refresh_test.state.json"
+    if stateFile.exists():
+        stateFile.unlink()
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.bulk_execute("DELETE FROM testBulkTable WHERE bulkId >= ?", [(100,)])
+    db.bulk_insert("testBulkTable", [(100, "a"), (101, "b")], fields=["bulkId", "bulkName"])
+
+    # bulkId is the watermark, bulkName the key: a new row for "a" replaces the old one
+    stats = db.refresh("bulkId", "bulkName", stateFile=stateFile)
+    assert stats == {"rows": 2, "inserted": 2, "updated": 0, "watermark": 101}
+
+    db.bulk_insert("testBulkTable", [(102, "a"), (103, "c")], fields=["bulkId", "bulkName"])
+    stats = db.refresh("bulkId", "bulkName", stateFile=stateFile)
+    assert stats == {"rows": 2, "inserted": 1, "updated": 1, "watermark": 103}
+    assert sorted((r["bulkName"], r["bulkId"]) for r in db.result) == [
+        ("a", 102),
+        ("b", 101),
+        ("c", 103),
+    ]
+    assert db.refresh("bulkId", "bulkName")["rows"] == 0
+
+    # a new process picks up the saved watermark
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    assert db.refresh("bulkId", "bulkName", stateFile=stateFile)["rows"] == 0
+    assert db.refresh("bulkId", "bulkName", full=True)["rows"] == 4
+
+    # fields the query does not return are rejected, the result and watermark are kept
+    watermark = db.watermark
+    assert db.refresh("bulkId", ["bulkNameX"]) is None
+    assert db.refresh("bulkIdX", "bulkName") is None
+    assert len(db.result) == 3
+    assert db.watermark == watermark
+
+    # tuple rows, also merged into a result loaded by run_query
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.settings["row_factory"] = "tuple"
+    db.run_query()
+    db.watermark = 102
+    db.bulk_insert("testBulkTable", [(104, "b")], fields=["bulkId", "bulkName"])
+    stats = db.refresh("bulkId", "bulkName")
+    assert stats == {"rows": 2, "inserted": 0, "updated": 2, "watermark": 104}
+    assert db.result.rowFormat == "tuple"
+    assert (104, "b") in db.result and (101, "b") not in db.result
+
+    db.bulk_execute("DELETE FROM testBulkTable WHERE bulkId >= ?", [(100,)])
+
+
+def test_sql_query_export_parts():
+    import gzip
+    import hashlib
+    import json
+    import shutil
+
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    outputDir = TEST_OUTPUT_DIR / "parts_test"
+    shutil.rmtree(outputDir, ignore_errors=True)
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.settings["batch_size"] = 2
+    manifest = db.export_parts(outputDir, partRows=4, selectedFields=["testInt", "testVarChar"])
+
+    assert manifest["rows"] == 6
+    assert [(p["file"], p["rows"]) for p in manifest["parts"]] == [
+        ("part-00000.csv.gz", 4),
+        ("part-00001.csv.gz", 2),
+    ]
+    with open(outputDir / "manifest.json") as fd:
+        assert json.load(fd)["parts"] == manifest["parts"]
+    data = (outputDir / "part-00001.csv.gz").read_bytes()
+    assert hashlib.sha256(data).hexdigest() == manifest["parts"][1]["sha256"]
+    assert gzip.decompress(data).decode("utf8").splitlines()[0] == "testInt,testVarChar"
+
+    shutil.rmtree(outputDir, ignore_errors=True)
+    manifest = db.export_parts(
+        outputDir, fmt="ndjson", compression=None, partitionField="testVarChar"
+    )
+    assert manifest["rows"] == 6
+    part = [p for p in manifest["parts"] if p["partition"] == "992"][0]
+    assert part["file"] == "testVarChar=992/part-00000.ndjson"
+    assert part["rows"] == 2
+
+    # buffered rows are capped across partitions, the largest buffer is written early
+    from gendb.export import PartitionedExport
+
+    exporter = PartitionedExport(
+        outputDir / "capped", "csv", None, partRows=100, partitionField="key", maxBufferedRows=3
+    )
+    for pos in range(20):
+        exporter.add_rows(["key", "value"], [(pos % 7, pos)], [pos % 7])
+        assert exporter._buffered <= 3
+    manifest = exporter.finish()
+    assert manifest["rows"] == 20
+    assert len(manifest["parts"]) > 7
+
+    manifest = db.export_parts(
+        outputDir / "capped_db",
+        "ndjson",
+        None,
+        partitionField="testInt",
+        batchSize=2,
+        maxBufferedRows=2,
+    )
+    assert manifest["rows"] == 6
+
+
+def test_logger_configured_once():
+    from gendb.log import LOG_FOLDER, get_logger
+
+    logger = get_logger("gendb.test_logger")
+    handlers = list(logger.handlers)
+    assert get_logger("gendb.test_logger").handlers == handlers
+    # console, plus the file only when LOG_FOLDER is set
+    assert len(handlers) == (1 if LOG_FOLDER is None else 2)
+
+
+def test_sql_query_row_factories():
+    import json
+
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    for rowFormat in ("tuple", "namedtuple", "record"):
+        db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+        db.settings["row_factory"] = rowFormat
+        db.run_query()
+
+        assert len(db.result) == 6
+        assert db.result[0][3] == 10
+        if rowFormat != "tuple":
+            assert db.result[1].testInt == 20
+        assert list(db.get_fields())[3] == "testInt"
+        assert db.get_field_data("testInt") == [10, 20, 30, 40, 50, 60]
+        assert [tuple(r) for r in db.select_fields(["testInt", "testIntNull"])][:2] == [
+            (10, 1),
+            (20, 2),
+        ]
+        assert db.lookup("testInt", 30)[0][1] == "vc30"
+
+        db.rename_fields({"testInt": "rename1"})
+        assert db.get_field_data("rename1")[-1] == 60
+        db.export_csv(TEST_OUTPUT_DIR / f"rows_{rowFormat}.csv")
+        with open(TEST_OUTPUT_DIR / f"rows_{rowFormat}.csv") as fd:
+            lines = fd.read().splitlines()
+        assert lines[0].split(",")[3] == "rename1"
+        assert len(lines) == 7
+        db.export_json(TEST_OUTPUT_DIR / f"rows_{rowFormat}.json")
+        with open(TEST_OUTPUT_DIR / f"rows_{rowFormat}.json") as fd:
+            assert json.load(fd)[0]["rename1"] == 10
+
+
+def test_sql_query_named_parameter_template():
+    from gendb.template import template_registry
+
+    sqlFile = TEST_OUTPUT_DIR / "template_test.sql"
+    sqlFile.write_text(
+        "SELECT * FROM testTable WHERE testInt > :low AND testInt < :high AND testVarChar <> ':low' "
+    )
+    db = SQLServer(env=test_env, sql=str(sqlFile), inVars={"low": 10, "high": 50}, dbg=False)
+    assert db.template.params == ("low", "high")
+    assert db.vars == [10, 50]
+    db.add_conditional("testIntNull", "!=", 3)
+    db.run_query()
+    assert [r["testInt"] for r in db.result] == [20, 40]
+
+    hits = template_registry().stats["hits"]
+    db = SQLServer(env=test_env, sql=str(sqlFile), inVars={"low": 30, "high": 60}, dbg=False)
+    assert template_registry().stats["hits"] == hits + 1
+    db.run_query()
+    assert [r["testInt"] for r in db.result] == [40, 50]
+
+    # a changed file is read again
+    sqlFile.write_text("SELECT * FROM testTable WHERE testInt = :value ")
+    db = SQLServer(env=test_env, sql=str(sqlFile), inVars={"value": 30}, dbg=False)
+    db.run_query()
+    assert [r["testVarChar"] for r in db.result] == ["vc30"]
+
+    with pytest.raises(KeyError):
+        db.vars = {"other": 1}
+
+
+def test_sql_query_projection_pushdown():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    assert db.project(["testInt", "testVarChar"], {"testInt": "rename1"})
+    db.add_conditional("testInt", ">", 30)
+    db.run_query()
+    assert [c[0] for c in db.description] == ["rename1", "testVarChar"]
+    assert db.result[0] == {"rename1": 40, "testVarChar": "992"}
+    assert not db.project(["testInt; DROP TABLE testTable"])
+
+    # queries that are not SELECT * are wrapped, a top level ORDER BY stays outside
+    sql = "SELECT testInt, testVarChar, testFloat FROM testTable WHERE testInt < 40 ORDER BY testInt DESC"
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.project(["testInt"])
+    db.run_query()
+    assert db.result == [{"testInt": 30}, {"testInt": 20}, {"testInt": 10}]
+
+    # an ORDER BY that picks the rows for TOP stays inside the derived table
+    db = SQLServer(
+        env=test_env,
+        sql="SELECT TOP (2) testInt, testVarChar FROM testTable ORDER BY testInt DESC",
+        dbg=False,
+    )
+    db.project(["testInt"])
+    db.run_query()
+    assert sorted(r["testInt"] for r in db.result) == [50, 60]
+
+    # ORDER BY in comments, literals and brackets is not the query's ORDER BY
+    sql = (
+        "SELECT testInt, [testVarChar] FROM testTable WHERE testVarChar <> 'ORDER BY' -- ORDER BY x"
+    )
+    db = SQLServer(env=test_env, sql=sql, dbg=False)
+    db.project(["testInt"])
+    db.run_query()
+    assert len(db.result) == 6
+
+    # streaming exports only select the exported columns
+    db = SQLServer(env=test_env, sql="SELECT * FROM testTable WHERE 1 = 1 ", dbg=False)
+    assert db.stream_csv(TEST_OUTPUT_DIR / "projection_test.csv", ["testInt", "testFloat"]) == 6
+    assert [c[0] for c in db.description] == ["testInt", "testFloat"]
+    with open(TEST_OUTPUT_DIR / "projection_test.csv") as fd:
+        assert fd.readline().strip() == "testInt,testFloat"
+
+    # fields the query does not return are skipped, not sent to the database
+    db = SQLServer(env=test_env, sql="SELECT * FROM testTable WHERE 1 = 1 ", dbg=False)
+    fullFilePath = TEST_OUTPUT_DIR / "projection_test_missing.csv"
+    assert db.stream_csv(fullFilePath, ["testInt", "noSuchField"]) == 6
+    assert [c[0] for c in db.description] == ["testInt"]
+    with open(fullFilePath) as fd:
+        assert fd.readline().strip() == "testInt"
+
+    # paginate needs its order fields under their own names
+    db = SQLServer(env=test_env, sql="SELECT * FROM testTable WHERE 1 = 1 ", dbg=False)
+    db.project(["testInt", "testVarChar"], {"testInt": "rename1"})
+    with pytest.raises(ValueError):
+        list(db.paginate("testInt", page_size=2))
+    db.project(["testInt", "testVarChar"])
+    assert [len(p) for p in db.paginate("testInt", page_size=4)] == [4, 2]
+
+
+def test_sql_query_fetch_budget():
+    sql = "SELECT * FROM testTable WHERE 1 = 1 "
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    db.settings["fetch_budget"] = 64 * 1024
+    db.run_query()
+    assert len(db.result) == 6
+    stats = db.fetch_stats
+    assert stats["rows"] == 6 and stats["batches"] == 1
+    assert stats["peak_bytes"] == stats["avg_bytes"] > 0
+
+    # fixed batch size, the stats cover every batch
+    db = SQLServer(env=test_env, sql=sql, inVars=None, dbg=False)
+    assert len(list(db.iter_query(batchSize=4))) == 6
+    assert db.fetch_stats["batches"] == 2
+    assert db.fetch_stats["max_batch_rows"] == 4 and db.fetch_stats["min_batch_rows"] == 2
+
+    # wide rows shrink the next batch, narrow rows grow it
+    from gendb.fetch import BatchSizer
+
+    description = [("testVarChar", str, 50, 50, 0, 0, True)]
+    sizer = BatchSizer(1024 * 1024, description)
+    first = sizer.size
+    sizer.observe([("x" * 20000,)] * 100)
+    assert sizer.size < first
+    wide = sizer.size
+    sizer.observe([("x",)] * wide)
+    assert wide < sizer.size <= wide * 2
+    assert sizer.stats()["peak_bytes"] > sizer.stats()["avg_bytes"]